@@ -1,12 +1,18 @@
-from flask import Flask, request, jsonify, render_template, session, Response, stream_with_context, send_from_directory
+from flask import Flask, request, jsonify, render_template, session, Response, stream_with_context, send_from_directory, g
 from flask_cors import CORS
-from models import db, Agent, Conversation, Message, User
+from models import db, Agent, Conversation, Message, User, AGENT_FIELDS, agent_rows, message_rows, conversation_summaries
 from autogen_service import run_autogen_chat
 from autogen_streaming import run_streaming_chat
+from assets import init_assets
+from fast_json import FastJSONProvider
+from auth_service import hash_password, verify_password, AuthBusyError, login_throttle, register_throttle
+from archive import conversation_messages, rehydrate, start_compaction_thread
+from profiling import init_profiling, span
 import os
 import json
 from dotenv import load_dotenv
 from functools import wraps
+from werkzeug.middleware.proxy_fix import ProxyFix
 
 load_dotenv()
 
@@ -19,6 +25,9 @@ logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
 app = Flask(__name__, static_folder='static', template_folder='templates')
+init_assets(app) # 带指纹 / 预压缩的静态资源 (需先运行 python assets.py 构建)
+app.json = FastJSONProvider(app) # 安装 orjson 时使用更快的编码器
+init_profiling(app) # 按请求开启的性能剖析 (X-Profile-Token 请求头或 PROFILE_SAMPLE_RATE 抽样)
 
 # Global Error Handler
 @app.errorhandler(Exception)
@@ -36,7 +45,17 @@ def handle_exception(e):
         "traceback": traceback.format_exc()
     }), 500
 
+@app.errorhandler(AuthBusyError)
+def handle_auth_busy(e):
+    # 密码哈希进程池已满，让客户端稍后重试，而不是占住 worker 排队
+    return jsonify({"error": "Server busy, please retry"}), 503, {"Retry-After": "1"}
+
 app.secret_key = os.environ.get('SECRET_KEY', 'dev_secret_key') # 必须设置 secret_key 才能使用 session
+
+# 前面有几层可信反向代理 (Render 为 1)；为 0 时忽略 X-Forwarded-For，客户端无法伪造来源 IP
+trusted_proxies = int(os.environ.get('TRUSTED_PROXY_COUNT', 0))
+if trusted_proxies:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=trusted_proxies)
 CORS(app, supports_credentials=True) # 允许跨域携带 cookie
 
 # 配置数据库
@@ -63,15 +82,40 @@ with app.app_context():
         print(f"Error creating database tables: {e}")
         print("Please ensure PostgreSQL is running and the database exists.")
 
+# 冷存储：设置 ARCHIVE_AFTER_DAYS 后，定期把长时间未活动的会话压缩归档
+if os.environ.get('ARCHIVE_AFTER_DAYS'):
+    start_compaction_thread(
+        app,
+        older_than_days=float(os.environ['ARCHIVE_AFTER_DAYS']),
+        interval=float(os.environ.get('ARCHIVE_INTERVAL', 3600)),
+    )
+
 # 登录验证装饰器
 def login_required(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
         if 'user_id' not in session:
             return jsonify({"error": "Unauthorized"}), 401
+        # 身份信息来自签名的 session cookie，不查数据库；各接口统一从 g.principal 读取当前用户
+        principal = session.get('principal')
+        if not principal or principal.get('id') != session['user_id']:
+            principal = {"id": session['user_id']}
+        g.principal = principal
         return f(*args, **kwargs)
     return decorated_function
 
+def set_principal(user_id, username):
+    # session cookie 由 secret_key 签名，客户端无法伪造，可直接作为身份缓存
+    session['user_id'] = user_id
+    session['principal'] = {"id": user_id, "username": username}
+
+def client_ip():
+    # 可信代理转发的地址已由 ProxyFix 写入 remote_addr
+    return request.remote_addr
+
+def too_many_attempts(retry_after):
+    return jsonify({"error": "Too many attempts, please try again later"}), 429, {"Retry-After": str(retry_after)}
+
 @app.route('/')
 def index():
     return render_template('index.html')
@@ -83,14 +127,19 @@ def register():
     username = data.get('username')
     password = data.get('password')
 
+    ip = client_ip()
+    retry_after = register_throttle.retry_after(ip)
+    if retry_after:
+        return too_many_attempts(retry_after)
+
     if not username or not password:
         return jsonify({"error": "Username and password required"}), 400
     
     if User.query.filter_by(username=username).first():
         return jsonify({"error": "Username already exists"}), 400
     
-    user = User(username=username)
-    user.set_password(password)
+    register_throttle.hit(ip)
+    user = User(username=username, password_hash=hash_password(password))
     db.session.add(user)
     db.session.commit()
     
@@ -161,47 +210,68 @@ def login():
     data = request.json
     username = data.get('username')
     password = data.get('password')
+
+    # 失败次数按 IP 和用户名分别限流，防止撞库占满哈希进程池
+    ip_key, user_key = f"ip:{client_ip()}", f"user:{username}"
+    retry_after = max(login_throttle.retry_after(ip_key), login_throttle.retry_after(user_key))
+    if retry_after:
+        return too_many_attempts(retry_after)
     
     user = User.query.filter_by(username=username).first()
-    if user and user.check_password(password):
-        session['user_id'] = user.id
+    if user and password and verify_password(user.password_hash, password):
+        login_throttle.reset(user_key)
+        set_principal(user.id, user.username)
         return jsonify({"message": "Login successful", "user": {"id": user.id, "username": user.username}})
     
+    login_throttle.hit(ip_key)
+    login_throttle.hit(user_key)
     return jsonify({"error": "Invalid credentials"}), 401
 
 @app.route('/api/guest_login', methods=['POST'])
 def guest_login():
-    session['user_id'] = 'guest'
+    set_principal('guest', "访客 (临时)")
     return jsonify({"message": "Guest login successful", "user": {"id": "guest", "username": "访客 (临时)"}})
 
 @app.route('/api/logout', methods=['POST'])
 def logout():
+    # 显式清除身份缓存
     session.pop('user_id', None)
+    session.pop('principal', None)
     return jsonify({"message": "Logged out"})
 
 @app.route('/api/me', methods=['GET'])
 def get_current_user():
     if 'user_id' not in session:
         return jsonify(None)
+
+    principal = session.get('principal')
+    if principal and principal.get('id') == session['user_id']:
+        return jsonify(principal)
     
     if session['user_id'] == 'guest':
         return jsonify({"id": "guest", "username": "访客 (临时)"})
 
+    # 旧 session 没有缓存身份，查一次数据库后写回
     user = User.query.get(session['user_id'])
     if not user:
         return jsonify(None)
-    return jsonify({"id": user.id, "username": user.username})
+    set_principal(user.id, user.username)
+    return jsonify(session['principal'])
 
 # --- Protected Agent Routes ---
 
 @app.route('/api/agents', methods=['GET'])
 @login_required
 def get_agents():
-    user_id = session['user_id']
+    user_id = g.principal['id']
     if user_id == 'guest':
         return jsonify([]) # 访客不从数据库读取
     
-    agents = Agent.query.filter_by(user_id=user_id).all()
+    # 支持 ?fields=id,name,config 只返回需要的列 (例如不需要很长的 system_message 时)
+    fields = AGENT_FIELDS
+    if request.args.get('fields'):
+        fields = tuple(f for f in request.args['fields'].split(',') if f in AGENT_FIELDS) or AGENT_FIELDS
+    agents = agent_rows(user_id, fields)
     
     # --- 如果用户没有智能体，自动预置默认智能体 ---
     if not agents:
@@ -265,14 +335,14 @@ def get_agents():
         db.session.commit()
         
         # 重新查询
-        agents = Agent.query.filter_by(user_id=user_id).all()
+        agents = agent_rows(user_id, fields)
 
-    return jsonify([a.to_dict() for a in agents])
+    return jsonify(agents)
 
 @app.route('/api/agents', methods=['POST'])
 @login_required
 def create_agent():
-    if session['user_id'] == 'guest':
+    if g.principal['id'] == 'guest':
         # 访客创建的智能体不保存到数据库，仅前端维护
         # 这里返回一个模拟的响应，但实际上前端应该自己处理
         return jsonify({"id": 999, "name": "Temp", "user_id": "guest"}), 200
@@ -282,7 +352,7 @@ def create_agent():
         return jsonify({"error": "Name is required"}), 400
         
     new_agent = Agent(
-        user_id=session['user_id'], # 关联当前用户
+        user_id=g.principal['id'], # 关联当前用户
         name=data['name'],
         system_message=data.get('system_message', ''),
         config=data.get('config', {})
@@ -294,7 +364,7 @@ def create_agent():
 @app.route('/api/agents/<int:id>', methods=['DELETE'])
 @login_required
 def delete_agent(id):
-    agent = Agent.query.filter_by(id=id, user_id=session['user_id']).first_or_404()
+    agent = Agent.query.filter_by(id=id, user_id=g.principal['id']).first_or_404()
     db.session.delete(agent)
     db.session.commit()
     return jsonify({"message": "Agent deleted"})
@@ -302,17 +372,17 @@ def delete_agent(id):
 @app.route('/api/conversations', methods=['GET'])
 @login_required
 def get_conversations():
-    user_id = session['user_id']
+    user_id = g.principal['id']
     if user_id == 'guest':
         return jsonify([])
     
-    convs = Conversation.query.filter_by(user_id=user_id).order_by(Conversation.updated_at.desc()).all()
-    return jsonify([c.to_dict() for c in convs])
+    # 附带 message_count / last_message_preview，一次聚合查询完成
+    return jsonify(conversation_summaries(user_id))
 
 @app.route('/api/conversations', methods=['POST'])
 @login_required
 def create_conversation():
-    user_id = session['user_id']
+    user_id = g.principal['id']
     if user_id == 'guest':
         return jsonify({"id": "temp", "title": "Temporary Chat"}), 200
         
@@ -328,19 +398,32 @@ def create_conversation():
 @app.route('/api/conversations/<int:id>', methods=['GET'])
 @login_required
 def get_conversation(id):
-    user_id = session['user_id']
+    user_id = g.principal['id']
     conv = Conversation.query.filter_by(id=id, user_id=user_id).first_or_404()
-    messages = Message.query.filter_by(conversation_id=id).order_by(Message.timestamp.asc()).all()
     
+    # 已归档的会话从压缩段落读取，对前端透明
     return jsonify({
         "conversation": conv.to_dict(),
-        "messages": [m.to_dict() for m in messages]
+        "messages": conversation_messages(id)
     })
 
+@app.route('/api/conversations/<int:id>/export', methods=['GET'])
+@login_required
+def export_conversation(id):
+    user_id = g.principal['id']
+    conv = Conversation.query.filter_by(id=id, user_id=user_id).first_or_404()
+
+    response = jsonify({
+        "conversation": conv.to_dict(),
+        "messages": conversation_messages(id)
+    })
+    response.headers['Content-Disposition'] = f'attachment; filename="conversation-{id}.json"'
+    return response
+
 @app.route('/api/conversations/<int:id>', methods=['PUT'])
 @login_required
 def update_conversation(id):
-    user_id = session['user_id']
+    user_id = g.principal['id']
     conv = Conversation.query.filter_by(id=id, user_id=user_id).first_or_404()
     data = request.json
     
@@ -365,7 +448,7 @@ def chat_stream():
     history = []
     agent_ids = []
     
-    user_id = session['user_id']
+    user_id = g.principal['id']
     is_guest = (user_id == 'guest')
     
     # --- Guest Mode Handling ---
@@ -397,9 +480,12 @@ def chat_stream():
                      conv.agent_ids = agent_ids
                      db.session.commit()
             
-            # Load Messages
-            db_msgs = Message.query.filter_by(conversation_id=conversation_id).order_by(Message.timestamp.asc()).all()
-            history = [m.to_dict() for m in db_msgs]
+            with span("load_history"):
+                # 已归档的会话继续聊天：先把消息恢复回 message 表，再追加新消息
+                rehydrate(conversation_id)
+
+                # Load Messages
+                history = message_rows(conversation_id, ("role", "name", "content"))
             
             # Fetch Agent Configs
             agents = Agent.query.filter(Agent.id.in_(agent_ids), Agent.user_id == user_id).all()
@@ -425,8 +511,9 @@ def chat_stream():
             name='User',
             content=user_input
         )
-        db.session.add(user_msg)
-        db.session.commit()
+        with span("db_commit", message="user"):
+            db.session.add(user_msg)
+            db.session.commit()
 
     def generate():
         # Stream wrapper to save to DB
@@ -440,7 +527,8 @@ def chat_stream():
                     json_str = chunk[6:].strip()
                     if json_str != "[DONE]":
                         try:
-                            msg_data = json.loads(json_str)
+                            with span("json_parse"):
+                                msg_data = json.loads(json_str)
                             if "error" not in msg_data and not is_guest and conversation_id:
                                 # Save agent response to DB
                                 # msg_data has: role, content, name, timestamp
@@ -450,8 +538,9 @@ def chat_stream():
                                     name=msg_data.get('name'),
                                     content=msg_data.get('content'),
                                 )
-                                db.session.add(agent_msg)
-                                db.session.commit()
+                                with span("db_commit", message=msg_data.get('name')):
+                                    db.session.add(agent_msg)
+                                    db.session.commit()
                         except Exception as e:
                             print(f"Error saving message: {e}")
                 
@@ -0,0 +1,338 @@
+"""
+冷存储：长时间未活动的会话整体压缩成一个段落 (ConversationSegment)，从 message 表中移除
+
+- 压缩使用 zlib + 共享字典，字典由智能体人设文本生成，短消息也能获得不错的压缩率
+- 读取 (会话详情 / 导出) 时透明合并归档消息和仍在 message 表中的消息，解压结果放在有界 LRU 缓存中
+- 用户在已归档的会话中继续聊天时，先把消息恢复回 message 表 (rehydrate) 再写入
+
+用法:
+    python archive.py compact --days 30 --limit 500
+"""
+import json
+import logging
+import os
+import threading
+import time
+import zlib
+from collections import Counter, OrderedDict
+from datetime import datetime, timedelta
+
+from sqlalchemy import func
+
+from models import db, Agent, Conversation, Message, ArchiveDictionary, ConversationSegment, MESSAGE_FIELDS, PREVIEW_LENGTH, message_rows
+
+logger = logging.getLogger(__name__)
+
+ZDICT_SIZE = 32 * 1024  # zlib 只会用到字典末尾 32KB
+COMPRESS_LEVEL = 9
+SEGMENT_CACHE_SIZE = int(os.environ.get('SEGMENT_CACHE_SIZE', 64))
+
+# 序列化后的消息结构，放进字典末尾，让每条消息的键名也能直接引用字典；
+# 必须与 _encode 使用相同的 json.dumps 参数，否则字节对不上，字典里的这部分不起作用
+_RECORD_TEMPLATE = json.dumps([
+    {"id": 1, "role": "assistant", "name": "", "content": "", "timestamp": "2024-01-01T00:00:00"},
+    {"id": 2, "role": "user", "name": "User", "content": "", "timestamp": "2024-01-01T00:00:00"},
+], ensure_ascii=False, separators=(",", ":"))
+
+
+# --- 共享字典 ---
+
+def train_dictionary(texts):
+    """
+    根据人设文本生成 zlib 预设字典
+    :param texts: 人设文本列表 (允许重复，出现次数越多越靠近字典末尾)
+    :return: bytes
+    """
+    counts = Counter(t for t in texts if t)
+    # zlib 的匹配距离有限，越靠后的内容越容易被引用，因此最常见的人设放在最后
+    ordered = sorted(counts, key=lambda t: counts[t])
+    data = ("\n".join(ordered) + "\n" + _RECORD_TEMPLATE).encode('utf-8')
+    return data[-ZDICT_SIZE:]
+
+
+_dictionaries = {}
+_dictionaries_lock = threading.Lock()
+
+
+def _dictionary_data(dictionary_id):
+    if dictionary_id is None:
+        return b""
+    with _dictionaries_lock:
+        data = _dictionaries.get(dictionary_id)
+    if data is None:
+        data = db.session.query(ArchiveDictionary.data).filter(ArchiveDictionary.id == dictionary_id).scalar()
+        with _dictionaries_lock:
+            _dictionaries[dictionary_id] = data
+    return data
+
+
+def current_dictionary():
+    """
+    返回最新的字典 id；还没有字典时用现有人设训练一个
+    """
+    dictionary_id = db.session.query(func.max(ArchiveDictionary.id)).scalar()
+    if dictionary_id is not None:
+        return dictionary_id
+    return retrain_dictionary()
+
+
+def retrain_dictionary():
+    """
+    人设变化较大时重新训练；已有段落记录了各自的字典 id，不受影响
+    """
+    texts = [row[0] for row in db.session.query(Agent.system_message).limit(5000)]
+    dictionary = ArchiveDictionary(data=train_dictionary(texts))
+    db.session.add(dictionary)
+    db.session.commit()
+    return dictionary.id
+
+
+# --- 编解码 ---
+
+def _encode(messages, zdict):
+    payload = json.dumps(messages, ensure_ascii=False, separators=(",", ":")).encode('utf-8')
+    compressor = zlib.compressobj(COMPRESS_LEVEL, zlib.DEFLATED, zlib.MAX_WBITS, zdict=zdict) if zdict \
+        else zlib.compressobj(COMPRESS_LEVEL)
+    return compressor.compress(payload) + compressor.flush()
+
+
+def _decode(data, codec, zdict):
+    if codec != 'zlib':
+        raise ValueError(f"Unsupported segment codec: {codec}")
+    decompressor = zlib.decompressobj(zlib.MAX_WBITS, zdict=zdict) if zdict else zlib.decompressobj()
+    return json.loads(decompressor.decompress(data) + decompressor.flush())
+
+
+class SegmentCache:
+    """
+    解压后的段落 LRU 缓存 (进程内)
+    :param max_size: int, 最多缓存的段落数
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._items.get(key)
+            if value is not None:
+                self._items.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+    def discard(self, key):
+        with self._lock:
+            self._items.pop(key, None)
+
+
+# 键为 (段落 id, 归档时间)：SQLite 可能复用已删除的 id，加上归档时间避免读到旧内容
+segment_cache = SegmentCache(SEGMENT_CACHE_SIZE)
+
+
+# --- 读取 ---
+
+def archived_messages(conversation_id):
+    """
+    返回会话已归档的消息 (与 message_rows 相同的字段)，未归档返回空列表
+    返回值来自缓存，调用方不要修改
+    """
+    segment = db.session.query(
+        ConversationSegment.id, ConversationSegment.archived_at,
+        ConversationSegment.dictionary_id, ConversationSegment.codec,
+    ).filter(ConversationSegment.conversation_id == conversation_id).first()
+    if segment is None:
+        return []
+
+    key = (segment.id, segment.archived_at)
+    messages = segment_cache.get(key)
+    if messages is None:
+        data = db.session.query(ConversationSegment.data).filter(ConversationSegment.id == segment.id).scalar()
+        messages = _decode(data, segment.codec, _dictionary_data(segment.dictionary_id))
+        for m in messages:
+            m["conversation_id"] = conversation_id
+        segment_cache.put(key, messages)
+    return messages
+
+
+def conversation_messages(conversation_id, fields=MESSAGE_FIELDS):
+    """
+    会话的全部消息：归档段落在前，message 表中的消息在后
+    :param fields: 需要的字段，同 message_rows
+    """
+    archived = archived_messages(conversation_id)
+    live = message_rows(conversation_id, fields)
+    if not archived:
+        return live
+    if tuple(fields) != MESSAGE_FIELDS:
+        archived = [{f: m[f] for f in fields} for m in archived]
+    return archived + live
+
+
+# --- 归档 / 恢复 ---
+
+def archive_conversation(conversation_id, dictionary_id=None):
+    """
+    把会话当前的全部消息压缩成段落并从 message 表删除
+    :return: bool, 是否归档了消息
+    """
+    if db.session.query(ConversationSegment.id).filter_by(conversation_id=conversation_id).first():
+        return False
+    rows = message_rows(conversation_id)
+    if not rows:
+        return False
+
+    if dictionary_id is None:
+        dictionary_id = current_dictionary()
+    messages = [
+        {
+            "id": m["id"],
+            "role": m["role"],
+            "name": m["name"],
+            "content": m["content"],
+            "timestamp": m["timestamp"].isoformat() if m["timestamp"] else None,
+        }
+        for m in rows
+    ]
+    last = rows[-1]
+    db.session.add(ConversationSegment(
+        conversation_id=conversation_id,
+        dictionary_id=dictionary_id,
+        codec='zlib',
+        data=_encode(messages, _dictionary_data(dictionary_id)),
+        message_count=len(rows),
+        last_message_name=last["name"],
+        last_message_preview=(last["content"] or "")[:PREVIEW_LENGTH],
+    ))
+    # 只删除已写入段落的消息，归档期间新写入的消息 id 更大，会留在 message 表中
+    max_id = max(m["id"] for m in rows)
+    Message.query.filter(Message.conversation_id == conversation_id, Message.id <= max_id) \
+        .delete(synchronize_session=False)
+    db.session.commit()
+    return True
+
+
+def rehydrate(conversation_id):
+    """
+    把已归档会话的消息恢复回 message 表 (保留时间戳，id 由数据库重新分配)，之后可以正常追加消息
+    SQLite 会复用已删除的最大 id，原 id 可能已被其他消息占用；消息顺序由 timestamp 决定，不依赖 id
+    :return: bool, 本次调用是否恢复了消息
+    """
+    segment = ConversationSegment.query.filter_by(conversation_id=conversation_id).first()
+    if segment is None:
+        return False
+    key = (segment.id, segment.archived_at)
+    messages = _decode(segment.data, segment.codec, _dictionary_data(segment.dictionary_id))
+
+    # 先按 id 删除段落：两个请求同时恢复同一会话时，只有删除成功的一方写入消息，另一方不会重复插入
+    deleted = ConversationSegment.query.filter_by(id=segment.id).delete(synchronize_session=False)
+    if not deleted:
+        db.session.rollback()
+        return False
+    db.session.add_all([
+        Message(
+            conversation_id=conversation_id,
+            role=m["role"],
+            name=m["name"],
+            content=m["content"],
+            timestamp=datetime.fromisoformat(m["timestamp"]) if m["timestamp"] else None,
+        )
+        for m in messages
+    ])
+    db.session.commit()
+    segment_cache.discard(key)
+    return True
+
+
+def compact(older_than_days, limit=100):
+    """
+    归档超过 older_than_days 天没有更新、也没有新消息的会话
+    :param limit: int, 单次最多处理的会话数
+    :return: int, 本次归档的会话数
+    """
+    cutoff = datetime.utcnow() - timedelta(days=older_than_days)
+    last_activity = (
+        db.session.query(
+            Message.conversation_id.label("conversation_id"),
+            func.max(Message.timestamp).label("last_at"),
+        )
+        .group_by(Message.conversation_id)
+        .subquery()
+    )
+    candidates = [
+        row[0] for row in
+        db.session.query(Conversation.id)
+        .join(last_activity, last_activity.c.conversation_id == Conversation.id)
+        .outerjoin(ConversationSegment, ConversationSegment.conversation_id == Conversation.id)
+        .filter(
+            ConversationSegment.id.is_(None),
+            Conversation.updated_at < cutoff,
+            last_activity.c.last_at < cutoff,
+        )
+        .order_by(last_activity.c.last_at.asc())
+        .limit(limit)
+    ]
+    if not candidates:
+        return 0
+
+    dictionary_id = current_dictionary()
+    archived = 0
+    for conversation_id in candidates:
+        try:
+            if archive_conversation(conversation_id, dictionary_id):
+                archived += 1
+        except Exception:
+            db.session.rollback()
+            logger.exception(f"Failed to archive conversation {conversation_id}")
+    return archived
+
+
+def start_compaction_thread(app, older_than_days, interval=3600, limit=100):
+    """
+    后台定期归档 (守护线程，每个 worker 进程一个；重复归档会被段落的唯一约束挡住)
+    :param interval: float, 两次归档之间的间隔 (秒)
+    """
+    def loop():
+        while True:
+            time.sleep(interval)
+            with app.app_context():
+                try:
+                    count = compact(older_than_days, limit)
+                    if count:
+                        logger.info(f"Archived {count} idle conversations")
+                except Exception:
+                    db.session.rollback()
+                    logger.exception("Conversation compaction failed")
+                finally:
+                    db.session.remove()
+
+    thread = threading.Thread(target=loop, name="archive-compaction", daemon=True)
+    thread.start()
+    return thread
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Archive idle conversations")
+    parser.add_argument("command", choices=["compact", "retrain"])
+    parser.add_argument("--days", type=float, default=float(os.environ.get('ARCHIVE_AFTER_DAYS', 30)))
+    parser.add_argument("--limit", type=int, default=500)
+    args = parser.parse_args()
+
+    from app import app
+
+    with app.app_context():
+        if args.command == "retrain":
+            print(f"Trained dictionary {retrain_dictionary()}")
+        else:
+            print(f"Archived {compact(args.days, args.limit)} conversations")
@@ -0,0 +1,313 @@
+"""
+静态资源构建与分发
+
+构建 (部署前执行一次):
+    python assets.py [--require-tailwind]
+会在 static/dist/ 下生成:
+    - 按模板实际用到的 class 裁剪后的 daisyUI CSS
+    - 预编译的 Tailwind CSS (需要 PATH 中有 tailwindcss 独立可执行文件；没有时前端继续使用浏览器内 JIT，
+      加 --require-tailwind 时直接构建失败)
+    - 所有文件带内容哈希的文件名，以及 .gz / .br 预压缩版本 (.br 需要安装 brotli)
+    - manifest.json: 逻辑路径 -> 带指纹的文件名
+
+运行时 init_assets(app) 注册:
+    - 模板函数 asset_url(path)，有 manifest 时返回带指纹的地址，否则退回 /static/<path>
+    - /static/dist/<filename> 路由：按 Accept-Encoding 协商预压缩版本，
+      带 immutable 的长缓存、ETag，并处理 If-None-Match 返回 304
+"""
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+
+from flask import abort, request, send_file
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+BASE_DIR = os.path.abspath(os.path.dirname(__file__))
+STATIC_DIR = os.path.join(BASE_DIR, 'static')
+DIST_DIR = os.path.join(STATIC_DIR, 'dist')
+MANIFEST_PATH = os.path.join(DIST_DIR, 'manifest.json')
+TEMPLATE_PATHS = [os.path.join(BASE_DIR, 'templates', 'index.html')]
+
+# 需要指纹化和预压缩的原样资源
+VENDOR_ASSETS = [
+    'vendor/js/vue.global.min.js',
+    'vendor/js/axios.min.js',
+    'vendor/js/markdown-it.min.js',
+    'vendor/js/tailwindcss.js',
+]
+DAISYUI_CSS = 'vendor/css/daisyui.full.min.css'
+TAILWIND_CSS = 'dist/tailwind.css'  # manifest 中的逻辑路径
+
+# 在 JS 中动态拼接、扫描模板无法发现的 class
+SAFELIST = set()
+
+IMMUTABLE_MAX_AGE = 31536000
+ENCODINGS = [('br', '.br'), ('gzip', '.gz')]
+
+
+# --- CSS 裁剪 ---
+
+def _used_tokens(paths):
+    tokens = set(SAFELIST)
+    for path in paths:
+        with open(path, encoding='utf-8') as f:
+            tokens.update(re.findall(r"[^\s\"'`<>=,{}()]+", f.read()))
+    return tokens
+
+
+def _split_blocks(css):
+    """
+    将 CSS 拆成顶层的 (prelude, body) 列表；body 为 None 表示以分号结尾的语句 (如 @charset)
+    处理注释和字符串中的括号
+    """
+    blocks = []
+    i, start, n = 0, 0, len(css)
+    while i < n:
+        c = css[i]
+        if css.startswith('/*', i):
+            end = css.find('*/', i + 2)
+            end = n if end == -1 else end + 2
+            if not css[start:i].strip():
+                start = end
+            i = end
+            continue
+        if c in '"\'':
+            end = i + 1
+            while end < n and css[end] != c:
+                end += 2 if css[end] == '\\' else 1
+            i = end + 1
+            continue
+        if c == ';':
+            statement = css[start:i].strip()
+            if statement:
+                blocks.append((statement, None))
+            i += 1
+            start = i
+            continue
+        if c == '{':
+            depth, j = 1, i + 1
+            while j < n and depth:
+                if css[j] in '"\'':
+                    quote, j = css[j], j + 1
+                    while j < n and css[j] != quote:
+                        j += 2 if css[j] == '\\' else 1
+                elif css[j] == '{':
+                    depth += 1
+                elif css[j] == '}':
+                    depth -= 1
+                j += 1
+            blocks.append((css[start:i].strip(), css[i + 1:j - 1]))
+            i = start = j
+            continue
+        i += 1
+    return blocks
+
+
+def _strip_parens(selector):
+    """拆出括号外的部分和括号内的部分 (:not / :is / :where 等)"""
+    outside, inside, depth = [], [], 0
+    for c in selector:
+        if c == '(':
+            depth += 1
+        elif c == ')':
+            depth -= 1
+        elif depth:
+            inside.append(c)
+        else:
+            outside.append(c)
+    return ''.join(outside), ''.join(inside)
+
+
+def _classes(selector):
+    return {re.sub(r'\\(.)', r'\1', m) for m in re.findall(r'\.((?:\\.|[\w-])+)', selector)}
+
+
+def _selector_used(selector, tokens):
+    if ':not(' in selector:
+        # :not() 里的 class 不是必需的
+        selector = re.sub(r':not\((?:[^()]|\([^()]*\))*\)', '', selector)
+    for theme in re.findall(r'\[data-theme=["\']?([\w-]+)', selector):
+        if theme not in tokens:
+            return False
+    outside, inside = _strip_parens(selector)
+    required = _classes(outside)
+    if required:
+        return required <= tokens
+    optional = _classes(inside)
+    return not optional or bool(optional & tokens)
+
+
+def _split_selectors(prelude):
+    selectors, depth, current = [], 0, []
+    for c in prelude:
+        if c == ',' and depth == 0:
+            selectors.append(''.join(current))
+            current = []
+            continue
+        depth += c == '('
+        depth -= c == ')'
+        current.append(c)
+    selectors.append(''.join(current))
+    return [s.strip() for s in selectors if s.strip()]
+
+
+def purge_css(css, tokens):
+    out = []
+    for prelude, body in _split_blocks(css):
+        if body is None:
+            out.append(prelude + ';')
+        elif prelude.startswith(('@media', '@supports', '@layer', '@container')):
+            inner = purge_css(body, tokens)
+            if inner:
+                out.append(prelude + '{' + inner + '}')
+        elif prelude.startswith('@'):
+            # @keyframes / @font-face / @property 等原样保留
+            out.append(prelude + '{' + body + '}')
+        else:
+            selectors = [s for s in _split_selectors(prelude) if _selector_used(s, tokens)]
+            if selectors:
+                out.append(','.join(selectors) + '{' + body + '}')
+    return ''.join(out)
+
+
+# --- 构建 ---
+
+def _compile_tailwind(template_paths):
+    """调用 tailwindcss 命令行预编译模板用到的工具类；不可用时返回 None"""
+    # 只使用本地的独立可执行文件 (Dockerfile 中按固定版本安装)，构建过程不访问 npm
+    cli = shutil.which('tailwindcss')
+    if cli is None:
+        return None
+    command = [cli]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        src = os.path.join(tmp, 'input.css')
+        dst = os.path.join(tmp, 'output.css')
+        with open(src, 'w') as f:
+            f.write('@tailwind base;\n@tailwind components;\n@tailwind utilities;\n')
+        result = subprocess.run(
+            command + ['-i', src, '-o', dst, '--minify', '--content', ','.join(template_paths)],
+            capture_output=True,
+        )
+        if result.returncode != 0 or not os.path.exists(dst):
+            print(f"tailwindcss failed, keeping in-browser JIT: {result.stderr.decode(errors='replace')[:200]}")
+            return None
+        with open(dst, 'rb') as f:
+            return f.read()
+
+
+def _write_fingerprinted(logical_path, data):
+    name, ext = os.path.splitext(os.path.basename(logical_path))
+    digest = hashlib.sha256(data).hexdigest()[:12]
+    filename = f"{name}.{digest}{ext}"
+    path = os.path.join(DIST_DIR, filename)
+    with open(path, 'wb') as f:
+        f.write(data)
+    with gzip.open(path + '.gz', 'wb', compresslevel=9) as f:
+        f.write(data)
+    if brotli is not None:
+        with open(path + '.br', 'wb') as f:
+            f.write(brotli.compress(data, quality=11))
+    return filename
+
+
+def build_assets(require_tailwind=False):
+    """
+    构建 static/dist/ 和 manifest.json
+    :param require_tailwind: bool, tailwindcss 不可用时抛出异常，而不是退回浏览器内 JIT
+    """
+    if os.path.isdir(DIST_DIR):
+        shutil.rmtree(DIST_DIR)
+    os.makedirs(DIST_DIR)
+
+    manifest = {}
+    for logical_path in VENDOR_ASSETS:
+        with open(os.path.join(STATIC_DIR, logical_path), 'rb') as f:
+            manifest[logical_path] = _write_fingerprinted(logical_path, f.read())
+
+    tokens = _used_tokens(TEMPLATE_PATHS)
+    with open(os.path.join(STATIC_DIR, DAISYUI_CSS), encoding='utf-8') as f:
+        daisyui = f.read()
+    purged = purge_css(daisyui, tokens).encode('utf-8')
+    manifest[DAISYUI_CSS] = _write_fingerprinted(DAISYUI_CSS, purged)
+    print(f"daisyUI CSS: {len(daisyui.encode('utf-8'))} -> {len(purged)} bytes")
+
+    tailwind = _compile_tailwind(TEMPLATE_PATHS)
+    if tailwind is None and require_tailwind:
+        raise RuntimeError("tailwindcss CLI not found or failed; refusing to ship the in-browser JIT")
+    if tailwind is not None:
+        manifest[TAILWIND_CSS] = _write_fingerprinted(TAILWIND_CSS, tailwind)
+        print(f"Tailwind CSS precompiled: {len(tailwind)} bytes")
+
+    with open(MANIFEST_PATH, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+# --- 运行时 ---
+
+def load_manifest():
+    try:
+        with open(MANIFEST_PATH) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def init_assets(app):
+    manifest = load_manifest()
+
+    @app.context_processor
+    def asset_helpers():
+        def asset_url(path):
+            if path in manifest:
+                return f"/static/dist/{manifest[path]}"
+            return f"/static/{path}"
+        return {
+            "asset_url": asset_url,
+            "tailwind_precompiled": TAILWIND_CSS in manifest,
+        }
+
+    # /static/dist/ 比默认的 /static/<path> 更具体，会优先匹配
+    @app.route('/static/dist/<path:filename>')
+    def dist_asset(filename):
+        if filename not in manifest.values():
+            abort(404)
+        path = os.path.join(DIST_DIR, filename)
+        mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+
+        accepted = request.accept_encodings
+        encoding = None
+        for name, suffix in ENCODINGS:
+            if accepted[name] and os.path.exists(path + suffix):
+                encoding, path = name, path + suffix
+                break
+
+        # 文件名已包含内容哈希，ETag 只需区分编码
+        etag = filename + ('-' + encoding if encoding else '')
+        response = send_file(path, mimetype=mimetype, conditional=True, etag=etag, max_age=IMMUTABLE_MAX_AGE)
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+        response.headers['Vary'] = 'Accept-Encoding'
+        response.headers['Cache-Control'] = f'public, max-age={IMMUTABLE_MAX_AGE}, immutable'
+        return response
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Build fingerprinted, precompressed static assets")
+    parser.add_argument('--require-tailwind', action='store_true',
+                        help="tailwindcss 不可用时构建失败 (生产镜像使用)")
+    args = parser.parse_args()
+    build_assets(require_tailwind=args.require_tailwind)
@@ -0,0 +1,160 @@
+"""
+登录 / 注册热路径：密码哈希放到独立进程池，并按 IP / 用户名限流
+
+werkzeug 的 generate_password_hash / check_password_hash 故意设计得很慢，
+直接在请求线程里执行时，一波登录请求就会占满同步 worker，连带正在推流的对话一起卡住。
+"""
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+from werkzeug.security import generate_password_hash, check_password_hash
+
+HASH_WORKERS = int(os.environ.get('AUTH_HASH_WORKERS', 2))
+HASH_QUEUE_SIZE = int(os.environ.get('AUTH_HASH_QUEUE_SIZE', 8))  # 排队 + 执行中的哈希任务上限
+HASH_TIMEOUT = 10.0
+
+
+class AuthBusyError(Exception):
+    """哈希任务队列已满或超时，调用方应返回 503"""
+
+
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+_slots = threading.BoundedSemaphore(HASH_QUEUE_SIZE)
+
+
+def _get_executor():
+    # gunicorn 会 fork 出多个 worker，进程池必须在各自进程里懒加载
+    global _executor, _executor_pid
+    with _executor_lock:
+        if _executor is None or _executor_pid != os.getpid():
+            _executor = ProcessPoolExecutor(max_workers=HASH_WORKERS)
+            _executor_pid = os.getpid()
+        return _executor
+
+
+def _discard_executor(executor):
+    # 子进程被杀 (OOM 等) 后进程池永久不可用，丢弃它，下次调用重新创建
+    global _executor
+    with _executor_lock:
+        if _executor is executor:
+            _executor = None
+    executor.shutdown(wait=False)
+
+
+def _submit(func, *args):
+    if not _slots.acquire(blocking=False):
+        raise AuthBusyError("Too many concurrent authentication requests")
+    executor = _get_executor()
+    try:
+        future = executor.submit(func, *args)
+    except BrokenProcessPool:
+        _slots.release()
+        _discard_executor(executor)
+        raise
+    except BaseException:
+        _slots.release()
+        raise
+    # 名额在任务真正结束时释放，超时返回的请求不会让队列无限变长
+    future.add_done_callback(lambda _: _slots.release())
+    return executor, future
+
+
+def _run(func, *args):
+    for _ in range(2):
+        try:
+            executor, future = _submit(func, *args)
+        except BrokenProcessPool:
+            continue
+        try:
+            return future.result(timeout=HASH_TIMEOUT)
+        except FutureTimeoutError:
+            raise AuthBusyError("Password hashing timed out")
+        except BrokenProcessPool:
+            # 换一个新的进程池重试一次
+            _discard_executor(executor)
+    raise AuthBusyError("Password hashing workers unavailable")
+
+
+def hash_password(password):
+    return _run(generate_password_hash, password)
+
+
+def verify_password(password_hash, password):
+    return _run(check_password_hash, password_hash, password)
+
+
+class Throttle:
+    """
+    滑动窗口计数限流 (进程内)
+    :param max_attempts: int, 窗口内允许的最大次数
+    :param window: float, 窗口长度 (秒)
+    :param max_keys: int, 最多记录的 key 数，超出时丢弃最久没有命中的 key
+    """
+
+    def __init__(self, max_attempts, window, max_keys=10000):
+        self.max_attempts = max_attempts
+        self.window = window
+        self.max_keys = max_keys
+        # 按最后一次命中排序，过期的 key 总在最前面
+        self._hits = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _prune(self, key, now):
+        hits = self._hits.get(key)
+        if hits is None:
+            return None
+        while hits and now - hits[0] >= self.window:
+            hits.popleft()
+        if not hits:
+            del self._hits[key]
+            return None
+        return hits
+
+    def retry_after(self, key):
+        """未超限返回 0，否则返回还需等待的秒数"""
+        with self._lock:
+            now = time.monotonic()
+            hits = self._prune(key, now)
+            if hits is None or len(hits) < self.max_attempts:
+                return 0
+            return max(1, int(hits[0] + self.window - now) + 1)
+
+    def hit(self, key):
+        with self._lock:
+            now = time.monotonic()
+            hits = self._hits.get(key)
+            if hits is None:
+                hits = self._hits[key] = deque()
+            else:
+                self._hits.move_to_end(key)
+            hits.append(now)
+            self._sweep(now)
+
+    def _sweep(self, now):
+        # 随机用户名的撞库请求会不断产生新 key，每次命中时顺带清理，内存不会无限增长
+        while self._hits:
+            key, hits = next(iter(self._hits.items()))
+            if now - hits[-1] < self.window and len(self._hits) <= self.max_keys:
+                break
+            del self._hits[key]
+
+    def reset(self, key):
+        with self._lock:
+            self._hits.pop(key, None)
+
+
+# 失败的登录按用户名和 IP 分别计数；注册按 IP 计数
+login_throttle = Throttle(
+    max_attempts=int(os.environ.get('LOGIN_MAX_ATTEMPTS', 10)),
+    window=float(os.environ.get('LOGIN_THROTTLE_WINDOW', 300)),
+)
+register_throttle = Throttle(
+    max_attempts=int(os.environ.get('REGISTER_MAX_ATTEMPTS', 5)),
+    window=float(os.environ.get('REGISTER_THROTTLE_WINDOW', 3600)),
+)
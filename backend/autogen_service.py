@@ -1,5 +1,6 @@
 import autogen
-import os
+from llm_transport import ResilientTransport, ResilientAssistantAgent, ResilientGroupChatManager
+from llm_router import load_endpoints, agent_llm_config, speaker_selection_llm_config
 
 def run_autogen_chat(agents_config, user_input, history=None):
     """
@@ -9,21 +10,8 @@ def run_autogen_chat(agents_config, user_input, history=None):
     :param history: list of dict (optional), previous messages
     :return: list of messages
     """
-    api_key = os.environ.get("DEEPSEEK_API_KEY")
-    if not api_key:
-        raise ValueError("DEEPSEEK_API_KEY not found in environment variables")
-
-    # 配置 DeepSeek
-    base_llm_config = {
-        "config_list": [
-            {
-                "model": "deepseek-chat",
-                "api_key": api_key,
-                "base_url": "https://api.deepseek.com"
-            }
-        ],
-        "temperature": 0.7,
-    }
+    if not load_endpoints():
+        raise ValueError("DEEPSEEK_API_KEY or LLM_ENDPOINTS not found in environment variables")
 
     # 创建 User Proxy
     # human_input_mode="NEVER" 表示不请求人类输入，全自动运行
@@ -37,21 +25,22 @@ def run_autogen_chat(agents_config, user_input, history=None):
     # 创建 Assistants
     assistants = []
     for agent_conf in agents_config:
-        # 合并自定义配置
-        agent_llm_config = base_llm_config.copy()
+        # 合并自定义配置 (model / endpoint 决定路由)
+        custom_config = agent_conf.get('config', {})
+        llm_config = agent_llm_config(custom_config)
         
         # 如果 agent 有自定义的 llm_config，可以覆盖 (这里简单处理，支持 temperature)
-        custom_config = agent_conf.get('config', {})
         if 'temperature' in custom_config:
-             agent_llm_config['temperature'] = float(custom_config['temperature'])
+             llm_config['temperature'] = float(custom_config['temperature'])
 
-        assistant = autogen.AssistantAgent(
+        assistant = ResilientAssistantAgent(
             name=agent_conf['name'],
             system_message=agent_conf['system_message'],
             description=agent_conf.get('description'), # 用于 GroupChat 选择
-            llm_config=agent_llm_config,
+            llm_config=llm_config,
             human_input_mode=custom_config.get('human_input_mode', 'NEVER'),
-            max_consecutive_auto_reply=int(custom_config.get('max_consecutive_auto_reply', 10))
+            max_consecutive_auto_reply=int(custom_config.get('max_consecutive_auto_reply', 10)),
+            transport=ResilientTransport(custom_config.get('transport'))
         )
         assistants.append(assistant)
 
@@ -77,7 +66,7 @@ def run_autogen_chat(agents_config, user_input, history=None):
         messages=initial_messages, 
         max_round=20
     )
-    manager = autogen.GroupChatManager(groupchat=groupchat, llm_config=base_llm_config)
+    manager = ResilientGroupChatManager(groupchat=groupchat, llm_config=speaker_selection_llm_config())
     
     try:
         # 触发对话
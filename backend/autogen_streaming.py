@@ -3,46 +3,188 @@ import queue
 import threading
 import json
 import os
+from collections.abc import Sequence
 from datetime import datetime
+from llm_transport import ResilientTransport, ResilientAssistantAgent, ResilientGroupChatManager
+from llm_router import load_endpoints, agent_llm_config, speaker_selection_llm_config
+import profiling
 
-class TrackingGroupChat(autogen.GroupChat):
-    def __init__(self, queue, *args, **kwargs):
-        super().__init__(*args, **kwargs)
+class TrackedMessageList(list):
+    """
+    GroupChat.messages 的替身：追加消息时同时放入队列
+    pyautogen 0.1.x 的 run_chat 直接调用 groupchat.messages.append，不经过 GroupChat.append，
+    在这里拦截才能在各版本下都收到消息
+    """
+
+    def __init__(self, messages, queue, copy_messages=True):
+        super().__init__(messages)
         self._queue = queue
-    
-    def append(self, message, speaker):
-        # 将消息放入队列
-        # message is a dict: {'content': ..., 'role': ..., 'name': ...}
-        # speaker is the Agent object
+        self._copy_messages = copy_messages
+
+    def append(self, message):
+        super().append(message)
+        # message is a dict: {'content': ..., 'role': ..., 'name': ...}，name 已由 run_chat 设置为发言人
+        timestamp = datetime.utcnow().isoformat()
+        if not self._copy_messages:
+            # 共享日志模式：只传引用和时间戳，由消费端序列化
+            self._queue.put((message, timestamp))
+            return
         msg_copy = message.copy()
-        msg_copy['name'] = speaker.name # Ensure name is correct
-        msg_copy['timestamp'] = datetime.utcnow().isoformat()
+        msg_copy['timestamp'] = timestamp
         self._queue.put(msg_copy)
-        super().append(message, speaker)
 
-def run_streaming_chat(agents_config, user_input, history=None, max_round=10):
+
+class TrackingGroupChat(autogen.GroupChat):
+    def __init__(self, queue, *args, copy_messages=True, **kwargs):
+        super().__init__(*args, **kwargs)
+        # 将消息放入队列
+        self.messages = TrackedMessageList(self.messages, queue, copy_messages)
+        self._round = 0
+        self._round_span = None
+
+    def select_speaker(self, last_speaker, selector):
+        profile = profiling.current()
+        if profile is None:
+            return super().select_speaker(last_speaker, selector)
+        # 剖析时间线：一轮从选择发言人开始，到下一轮选择发言人 (或线程结束) 为止
+        if self._round_span is not None:
+            profile.end(self._round_span)
+        self._round += 1
+        self._round_span = profile.begin("round", round=self._round)
+        with profiling.span("select_speaker", round=self._round):
+            return super().select_speaker(last_speaker, selector)
+
+
+class SharedLogView(Sequence):
+    """
+    智能体视角下的共享日志只读视图
+    不复制消息，只记录起始偏移；按下标访问时才生成 OpenAI 格式的消息 (role 相对于该智能体)
+    """
+
+    __slots__ = ("_log", "_offset", "_name")
+
+    def __init__(self, log, offset, name):
+        self._log = log
+        self._offset = offset
+        self._name = name
+
+    def __len__(self):
+        return len(self._log) - self._offset
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._to_oai(self._log[self._offset + i]) for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("message index out of range")
+        return self._to_oai(self._log[self._offset + index])
+
+    def _to_oai(self, message):
+        # 与 ConversableAgent._append_oai_message 的转换规则保持一致
+        oai_message = {k: message[k] for k in ("content", "function_call", "name", "context") if k in message}
+        if "content" not in oai_message:
+            oai_message["content"] = None
+        if message.get("role") == "function":
+            oai_message["role"] = "function"
+        elif message.get("name") == self._name:
+            # 自己发出的消息在默认模式下由智能体本地保存，此时还没有被 run_chat 加上 name
+            oai_message["role"] = "assistant"
+            del oai_message["name"]
+        elif "function_call" in oai_message:
+            oai_message["role"] = "assistant"
+        else:
+            oai_message["role"] = "user"
+        return oai_message
+
+
+class SharedLogMessages:
+    """
+    替代 ConversableAgent._oai_messages
+    群聊中智能体只和 manager 对话，所以无论 key 是谁都返回同一份日志视图；每个智能体只保存一个偏移量
+    """
+
+    def __init__(self, log, name):
+        self._log = log
+        self._name = name
+        self.offset = len(log)
+
+    def __getitem__(self, conversation_id):
+        return SharedLogView(self._log, self.offset, self._name)
+
+    def __contains__(self, conversation_id):
+        return True
+
+    def get(self, conversation_id, default=None):
+        return self[conversation_id]
+
+    def clear(self):
+        self.offset = len(self._log)
+
+
+class SharedLogAgentMixin:
+    def use_shared_log(self, log):
+        self._oai_messages = SharedLogMessages(log, self.name)
+
+    def _append_oai_message(self, message, role, conversation_id, *args, **kwargs):
+        if not isinstance(self._oai_messages, SharedLogMessages):
+            return super()._append_oai_message(message, role, conversation_id, *args, **kwargs)
+        # 消息会由 GroupChat 写入共享日志，这里只做合法性校验
+        message = self._message_to_dict(message)
+        return "content" in message or "function_call" in message
+
+
+class SharedLogAssistantAgent(SharedLogAgentMixin, ResilientAssistantAgent):
+    pass
+
+
+class SharedLogUserProxyAgent(SharedLogAgentMixin, autogen.UserProxyAgent):
+    pass
+
+
+class SharedLogGroupChatManager(ResilientGroupChatManager):
+    def _append_oai_message(self, message, role, conversation_id, *args, **kwargs):
+        if role == "assistant":
+            # manager 广播给各智能体的消息已在共享日志中，不再逐个保留副本
+            message = self._message_to_dict(message)
+            return "content" in message or "function_call" in message
+        # 收到的回复只保留最后一条，run_chat 通过 last_message 读取
+        valid = super()._append_oai_message(message, role, conversation_id, *args, **kwargs)
+        del self._oai_messages[conversation_id][:-1]
+        return valid
+
+def run_streaming_chat(agents_config, user_input, history=None, max_round=10, shared_log=None):
     """
     运行 AutoGen 对话并流式返回消息
     :param agents_config: list of dict, 智能体配置
     :param user_input: str, 用户输入 (如果是 'CONTINUE' 且无内容，则可能需要特殊处理)
     :param history: list of dict, 历史消息
     :param max_round: int, 最大轮数
+    :param shared_log: bool, 是否使用共享消息日志 (智能体不再各自保存消息副本)，默认读取 SHARED_MESSAGE_LOG 环境变量
     :return: generator yielding JSON strings
     """
+    if shared_log is None:
+        shared_log = os.environ.get("SHARED_MESSAGE_LOG", "").lower() in ("1", "true", "yes")
+    # 请求开启了剖析时，后台对话线程也登记进去
+    profile = profiling.current()
     
-    api_key = os.environ.get("DEEPSEEK_API_KEY")
-    if not api_key:
-        yield f"data: {json.dumps({'error': '配置错误: 未找到 DEEPSEEK_API_KEY 环境变量'})}\n\n"
+    if not load_endpoints():
+        yield f"data: {json.dumps({'error': '配置错误: 未找到 DEEPSEEK_API_KEY 或 LLM_ENDPOINTS 环境变量'})}\n\n"
         yield "data: [DONE]\n\n"
         return
 
-    base_llm_config = {
-        "config_list": [{"model": "deepseek-chat", "api_key": api_key, "base_url": "https://api.deepseek.com"}],
-        "temperature": 0.7,
-    }
+    # 每个智能体按自己的 config.model / config.endpoint 路由，发言人选择可使用单独的廉价模型
+    try:
+        manager_llm_config = speaker_selection_llm_config()
+        llm_configs = [agent_llm_config(agent_cfg.get('config')) for agent_cfg in agents_config]
+    except ValueError as e:
+        yield f"data: {json.dumps({'error': f'配置错误: {e}'})}\n\n"
+        yield "data: [DONE]\n\n"
+        return
 
     # 1. 创建 UserProxy
-    user_proxy = autogen.UserProxyAgent(
+    user_proxy_cls = SharedLogUserProxyAgent if shared_log else autogen.UserProxyAgent
+    user_proxy = user_proxy_cls(
         name="User",
         system_message="A human admin.",
         code_execution_config=False,
@@ -51,19 +193,23 @@ def run_streaming_chat(agents_config, user_input, history=None, max_round=10):
     )
 
     # 2. 创建 Assistants
+    assistant_cls = SharedLogAssistantAgent if shared_log else ResilientAssistantAgent
     assistants = []
-    for agent_cfg in agents_config:
+    for agent_cfg, llm_config in zip(agents_config, llm_configs):
         # 合并 LLM 配置
-        llm_config = base_llm_config.copy()
+        transport_config = None
         if 'config' in agent_cfg and agent_cfg['config']:
             if 'temperature' in agent_cfg['config']:
                 llm_config['temperature'] = min(1.0, agent_cfg['config']['temperature']) # Fix temperature > 1.0 issue
+            # 重试 / 熔断 / 对冲配置，例如 {"max_retries": 3, "hedge": true}
+            transport_config = agent_cfg['config'].get('transport')
 
-        assistant = autogen.AssistantAgent(
+        assistant = assistant_cls(
             name=agent_cfg['name'],
             system_message=agent_cfg['system_message'],
             description=agent_cfg.get('description'), # 用于 GroupChat 选择
-            llm_config=llm_config
+            llm_config=llm_config,
+            transport=ResilientTransport(transport_config)
         )
         assistants.append(assistant)
 
@@ -90,10 +236,17 @@ def run_streaming_chat(agents_config, user_input, history=None, max_round=10):
         queue=msg_queue,
         agents=[user_proxy] + assistants, 
         messages=initial_messages, 
-        max_round=max_round
+        max_round=max_round,
+        copy_messages=not shared_log
     )
-    
-    manager = autogen.GroupChatManager(groupchat=groupchat, llm_config=base_llm_config)
+
+    if shared_log:
+        # groupchat.messages 即共享日志，各智能体的视图从当前位置 (历史消息之后) 开始
+        for agent in groupchat.agents:
+            agent.use_shared_log(groupchat.messages)
+        manager = SharedLogGroupChatManager(groupchat=groupchat, llm_config=manager_llm_config)
+    else:
+        manager = ResilientGroupChatManager(groupchat=groupchat, llm_config=manager_llm_config)
 
     # 5. 在线程中运行 initiate_chat
     def run_chat_thread():
@@ -111,11 +264,13 @@ def run_streaming_chat(agents_config, user_input, history=None, max_round=10):
             if not prompt:
                 prompt = "Please continue the discussion."
 
-            user_proxy.initiate_chat(
-                manager,
-                message=prompt,
-                clear_history=False
-            )
+            # 剖析登记在放入结束标记之前解除，请求线程收尾时本线程的 span 已全部关闭
+            with profiling.attach(profile, "run_chat_thread"):
+                user_proxy.initiate_chat(
+                    manager,
+                    message=prompt,
+                    clear_history=False
+                )
         except Exception as e:
             msg_queue.put({"error": str(e)})
         finally:
@@ -141,6 +296,10 @@ def run_streaming_chat(agents_config, user_input, history=None, max_round=10):
             msg = msg_queue.get(timeout=600) # Wait up to 600s for a message (agents can be slow)
             if msg is None:
                 break
+            if isinstance(msg, tuple):
+                message, timestamp = msg
+                msg = {k: message[k] for k in ('role', 'content', 'name') if k in message}
+                msg['timestamp'] = timestamp
             
             if "error" in msg:
                 # 捕获并格式化详细错误信息
@@ -0,0 +1,117 @@
+"""
+群聊内存基准：对比默认模式与共享消息日志模式下，单次对话的内存占用随历史长度 / 智能体数量的变化
+
+用法:
+    python bench_groupchat_memory.py --history 0 200 1000 --agents 2 5 --rounds 10
+
+LLM 调用被替换为本地假实现 (轮流选择发言人、返回固定长度回复)，不会访问网络。
+每个用例在独立子进程中运行，输出 RSS 增量和 tracemalloc 峰值。
+"""
+import argparse
+import contextlib
+import multiprocessing
+import os
+import queue
+import resource
+import time
+import tracemalloc
+
+
+def _fake_create(reply_size):
+    state = {"turn": 0}
+
+    def create(messages=None, **kwargs):
+        last = messages[-1]["content"] or ""
+        if last.startswith("Read the above conversation"):
+            # 发言人选择：按顺序轮流
+            names = last.split("[", 1)[1].split("]", 1)[0].replace("'", "").split(", ")
+            names = [n for n in names if n != "User"]
+            content = names[state["turn"] % len(names)]
+            state["turn"] += 1
+        else:
+            content = "x" * reply_size
+        return {"choices": [{"index": 0, "message": {"role": "assistant", "content": content}}]}
+
+    return create
+
+
+def _rss_kb():
+    # Linux 上 ru_maxrss 单位为 KB
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def _run_case(history_len, agent_count, rounds, message_size, shared_log, result_queue):
+    os.environ.setdefault("DEEPSEEK_API_KEY", "bench")
+    import openai
+    openai.ChatCompletion.create = _fake_create(message_size)
+    from autogen_streaming import run_streaming_chat
+
+    agents_config = [
+        {"name": f"Agent{i}", "system_message": "You are a helpful assistant.", "config": {}}
+        for i in range(agent_count)
+    ]
+    # 每条历史消息都是独立字符串，模拟从数据库加载的记录
+    history = [
+        {"role": "user" if i % 2 == 0 else "assistant", "name": f"Agent{i % max(agent_count, 1)}",
+         "content": str(i) + "h" * message_size}
+        for i in range(history_len)
+    ]
+
+    rss_before = _rss_kb()
+    tracemalloc.start()
+    # AutoGen 会把每条消息打印到控制台，子进程里丢弃这些输出
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        for _ in run_streaming_chat(agents_config, "Start the benchmark discussion.", history,
+                                    max_round=rounds, shared_log=shared_log):
+            pass
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    result_queue.put((_rss_kb() - rss_before, peak // 1024))
+
+
+def _wait_result(proc, result_queue, timeout):
+    # 子进程异常退出时不会放入结果，不能无限阻塞在 queue.get 上
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            return result_queue.get(timeout=0.5)
+        except queue.Empty:
+            if not proc.is_alive():
+                try:
+                    return result_queue.get_nowait()
+                except queue.Empty:
+                    return None
+    proc.terminate()
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Group chat memory benchmark")
+    parser.add_argument("--history", type=int, nargs="+", default=[0, 200, 1000])
+    parser.add_argument("--agents", type=int, nargs="+", default=[2, 5])
+    parser.add_argument("--rounds", type=int, default=10)
+    parser.add_argument("--message-size", type=int, default=2000)
+    parser.add_argument("--timeout", type=float, default=600, help="单个用例的超时时间 (秒)")
+    args = parser.parse_args()
+
+    ctx = multiprocessing.get_context("spawn")
+    print(f"{'history':>8} {'agents':>6} {'mode':>8} {'rss_kb':>10} {'peak_kb':>10}")
+    for history_len in args.history:
+        for agent_count in args.agents:
+            for shared_log in (False, True):
+                result_queue = ctx.Queue()
+                proc = ctx.Process(target=_run_case, args=(
+                    history_len, agent_count, args.rounds, args.message_size, shared_log, result_queue))
+                proc.start()
+                result = _wait_result(proc, result_queue, args.timeout)
+                proc.join()
+                mode = "shared" if shared_log else "copy"
+                if result is None:
+                    print(f"{history_len:>8} {agent_count:>6} {mode:>8} failed (exit code {proc.exitcode})")
+                    continue
+                rss_kb, peak_kb = result
+                print(f"{history_len:>8} {agent_count:>6} {mode:>8} {rss_kb:>10} {peak_kb:>10}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""
+列表接口 CPU 基准：对比旧的 ORM 对象 + to_dict() + 标准库 json 路径与列投影 + 聚合查询 + FastJSONProvider
+
+用法:
+    python bench_list_endpoints.py --conversations 1000 --messages 10000 --iterations 20
+
+使用临时 SQLite 数据库，输出每次请求的平均 CPU 时间 (process_time)。
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+
+PERSONA = "你是一位经验丰富的顾问，说话简洁，善于分析问题并给出可执行的建议。" * 20
+
+
+def _seed(db, User, Agent, Conversation, Message, conversations, messages, message_size):
+    user = User(username="bench", password_hash="x")
+    db.session.add(user)
+    db.session.commit()
+
+    db.session.add_all([
+        Agent(user_id=user.id, name=f"Agent{i}", system_message=PERSONA, config={"temperature": 0.7})
+        for i in range(5)
+    ])
+    convs = [Conversation(user_id=user.id, title=f"Chat {i}", agent_ids=[1, 2, 3]) for i in range(conversations)]
+    db.session.add_all(convs)
+    db.session.commit()
+
+    body = "消" * message_size
+    db.session.add_all([
+        Message(conversation_id=convs[i % conversations].id, role="assistant", name=f"Agent{i % 5}",
+                content=f"{i} {body}")
+        for i in range(messages)
+    ])
+    db.session.commit()
+    return user.id, convs[0].id
+
+
+def _cpu_ms(func, iterations, reset):
+    func()  # 预热
+    total = 0.0
+    for _ in range(iterations):
+        reset()
+        start = time.process_time()
+        func()
+        total += time.process_time() - start
+    return total / iterations * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="List endpoint CPU benchmark")
+    parser.add_argument("--conversations", type=int, default=1000)
+    parser.add_argument("--messages", type=int, default=10000)
+    parser.add_argument("--message-size", type=int, default=500)
+    parser.add_argument("--iterations", type=int, default=20)
+    args = parser.parse_args()
+
+    # 必须在导入 app 之前设置，app 导入时就会建表
+    db_dir = tempfile.mkdtemp()
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(db_dir, 'bench.db')}"
+    from app import app
+    from models import db, User, Agent, Conversation, Message, agent_rows, message_rows, conversation_summaries
+
+    with app.app_context():
+        user_id, conv_id = _seed(db, User, Agent, Conversation, Message,
+                                 args.conversations, args.messages, args.message_size)
+
+        def legacy_conversations():
+            convs = Conversation.query.filter_by(user_id=user_id).order_by(Conversation.updated_at.desc()).all()
+            return json.dumps([c.to_dict() for c in convs])
+
+        def legacy_conversations_n_plus_1():
+            # 旧路径上要拿到消息数和最后一条消息，只能逐个会话查询
+            convs = Conversation.query.filter_by(user_id=user_id).order_by(Conversation.updated_at.desc()).all()
+            result = []
+            for c in convs:
+                d = c.to_dict()
+                d["message_count"] = Message.query.filter_by(conversation_id=c.id).count()
+                last = Message.query.filter_by(conversation_id=c.id).order_by(Message.id.desc()).first()
+                d["last_message_preview"] = last.content[:80] if last else None
+                result.append(d)
+            return json.dumps(result)
+
+        def legacy_agents():
+            return json.dumps([a.to_dict() for a in Agent.query.filter_by(user_id=user_id).all()])
+
+        def legacy_conversation():
+            conv = Conversation.query.filter_by(id=conv_id, user_id=user_id).first()
+            msgs = Message.query.filter_by(conversation_id=conv_id).order_by(Message.timestamp.asc()).all()
+            return json.dumps({"conversation": conv.to_dict(), "messages": [m.to_dict() for m in msgs]})
+
+        def lean_conversations():
+            return app.json.response(conversation_summaries(user_id)).get_data()
+
+        def lean_agents():
+            return app.json.response(agent_rows(user_id)).get_data()
+
+        def lean_agents_without_persona():
+            return app.json.response(agent_rows(user_id, ("id", "name", "config"))).get_data()
+
+        def lean_conversation():
+            conv = Conversation.query.filter_by(id=conv_id, user_id=user_id).first()
+            return app.json.response({"conversation": conv.to_dict(), "messages": message_rows(conv_id)}).get_data()
+
+        cases = [
+            ("GET /api/conversations", legacy_conversations, lean_conversations),
+            ("GET /api/conversations (+count/preview)", legacy_conversations_n_plus_1, lean_conversations),
+            ("GET /api/agents", legacy_agents, lean_agents),
+            ("GET /api/agents?fields=id,name,config", legacy_agents, lean_agents_without_persona),
+            ("GET /api/conversations/<id>", legacy_conversation, lean_conversation),
+        ]
+
+        print(f"{args.conversations} conversations, {args.messages} messages, orjson={'yes' if _has_orjson() else 'no'}")
+        print(f"{'endpoint':<42} {'legacy_ms':>10} {'lean_ms':>10}")
+        for name, legacy, lean in cases:
+            legacy_ms = _cpu_ms(legacy, args.iterations, db.session.expunge_all)
+            lean_ms = _cpu_ms(lean, args.iterations, db.session.expunge_all)
+            print(f"{name:<42} {legacy_ms:>10.2f} {lean_ms:>10.2f}")
+
+
+def _has_orjson():
+    from fast_json import orjson
+    return orjson is not None
+
+
+if __name__ == "__main__":
+    main()
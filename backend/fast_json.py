@@ -0,0 +1,33 @@
+"""
+Flask JSON provider：datetime 统一输出 ISO 8601；安装了 orjson 时用它编码响应
+"""
+from datetime import date
+
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    @staticmethod
+    def default(o):
+        # 与 Model.to_dict() 中的 isoformat() 保持一致，而不是 Flask 默认的 HTTP 日期格式
+        if isinstance(o, date):
+            return o.isoformat()
+        return DefaultJSONProvider.default(o)
+
+    def dumps(self, obj, **kwargs):
+        if orjson is None or kwargs:
+            return super().dumps(obj, **kwargs)
+        return orjson.dumps(obj, default=self.default, option=orjson.OPT_NON_STR_KEYS).decode('utf-8')
+
+    def response(self, *args, **kwargs):
+        if orjson is None:
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        # 直接输出 bytes，省去一次 decode / encode
+        data = orjson.dumps(obj, default=self.default, option=orjson.OPT_NON_STR_KEYS)
+        return self._app.response_class(data, mimetype=self.mimetype)
@@ -0,0 +1,85 @@
+"""
+本地故障注入桩：模拟 OpenAI 兼容的 /chat/completions 接口，用于测试 llm_transport
+
+用法:
+    python fault_stub.py --port 8765 --error-rate 0.3 --slow-rate 0.1 --slow-delay 5
+然后把智能体 config_list 中的 base_url 指向 http://127.0.0.1:8765
+"""
+import argparse
+import json
+import random
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FaultInjectingHandler(BaseHTTPRequestHandler):
+    error_rate = 0.0
+    error_status = 503
+    slow_rate = 0.0
+    slow_delay = 5.0
+    latency = 0.05
+
+    def do_POST(self):
+        if not self.path.rstrip('/').endswith('/chat/completions'):
+            self._reply(404, {"error": {"message": "Not found", "type": "invalid_request_error"}})
+            return
+
+        length = int(self.headers.get('Content-Length', 0))
+        body = json.loads(self.rfile.read(length) or b'{}')
+
+        delay = self.latency
+        if random.random() < self.slow_rate:
+            delay = self.slow_delay
+        time.sleep(delay)
+
+        if random.random() < self.error_rate:
+            self._reply(self.error_status, {"error": {"message": "Injected fault", "type": "server_error"}})
+            return
+
+        last = body.get('messages', [{}])[-1].get('content', '')
+        self._reply(200, {
+            "id": f"chatcmpl-{uuid.uuid4().hex}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get('model', 'stub'),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": f"[stub] {last[:50]}"},
+                "finish_reason": "stop",
+            }],
+            "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+        })
+
+    def _reply(self, status, payload):
+        data = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fault-injecting OpenAI-compatible stub")
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--error-status', type=int, default=503)
+    parser.add_argument('--slow-rate', type=float, default=0.0)
+    parser.add_argument('--slow-delay', type=float, default=5.0)
+    parser.add_argument('--latency', type=float, default=0.05)
+    args = parser.parse_args()
+
+    FaultInjectingHandler.error_rate = args.error_rate
+    FaultInjectingHandler.error_status = args.error_status
+    FaultInjectingHandler.slow_rate = args.slow_rate
+    FaultInjectingHandler.slow_delay = args.slow_delay
+    FaultInjectingHandler.latency = args.latency
+
+    server = ThreadingHTTPServer(('127.0.0.1', args.port), FaultInjectingHandler)
+    print(f"Fault stub listening on http://127.0.0.1:{args.port}")
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
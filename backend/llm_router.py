@@ -0,0 +1,92 @@
+import json
+import os
+
+DEFAULT_ENDPOINT = "deepseek"
+DEFAULT_BASE_URL = "https://api.deepseek.com"
+DEFAULT_MODEL = "deepseek-chat"
+
+
+def load_endpoints():
+    """
+    读取可用的 LLM 端点
+    优先使用 LLM_ENDPOINTS 环境变量 (JSON 列表)，例如:
+        [{"name": "deepseek", "base_url": "https://api.deepseek.com",
+          "api_keys": ["sk-a", "sk-b"], "models": ["deepseek-chat"], "rpm": 60}]
+    否则退回到 DEEPSEEK_API_KEY (多个 key 用逗号分隔)，每分钟限速取 DEEPSEEK_RPM，
+    可用模型取 DEEPSEEK_MODELS (逗号分隔，默认 deepseek-chat) 和 SPEAKER_SELECTION_MODEL
+    :return: list of dict
+    """
+    raw = os.environ.get("LLM_ENDPOINTS")
+    if raw:
+        return json.loads(raw)
+
+    api_keys = [k.strip() for k in os.environ.get("DEEPSEEK_API_KEY", "").split(",") if k.strip()]
+    if not api_keys:
+        return []
+
+    rpm = os.environ.get("DEEPSEEK_RPM")
+    models = [m.strip() for m in os.environ.get("DEEPSEEK_MODELS", DEFAULT_MODEL).split(",") if m.strip()]
+    speaker_model = os.environ.get("SPEAKER_SELECTION_MODEL")
+    if speaker_model and speaker_model not in models:
+        models.append(speaker_model)
+    return [{
+        "name": DEFAULT_ENDPOINT,
+        "base_url": DEFAULT_BASE_URL,
+        "api_keys": api_keys,
+        "models": models,
+        "rpm": int(rpm) if rpm else None,
+    }]
+
+
+def build_config_list(model=None, endpoint=None):
+    """
+    为指定模型 / 端点生成 AutoGen config_list，每个 API key 一条，供传输层负载均衡
+    :param model: str, 模型名，默认 deepseek-chat
+    :param endpoint: str, 端点名，为空时使用所有支持该模型的端点
+    :return: list of dict
+    """
+    model = model or DEFAULT_MODEL
+    config_list = []
+    for ep in load_endpoints():
+        if endpoint and ep.get("name") != endpoint:
+            continue
+        # 模型名来自 Agent.config (访客每次请求都会提交)，只允许端点明确列出的模型
+        if model not in (ep.get("models") or [DEFAULT_MODEL]):
+            continue
+        api_keys = ep.get("api_keys") or [ep.get("api_key")]
+        for api_key in api_keys:
+            config_list.append({
+                "model": model,
+                "api_key": api_key,
+                "base_url": ep.get("base_url", DEFAULT_BASE_URL),
+                "rpm": ep.get("rpm"),
+            })
+
+    if not config_list:
+        raise ValueError(f"No LLM endpoint configured for model '{model}'" + (f" on '{endpoint}'" if endpoint else ""))
+    return config_list
+
+
+def agent_llm_config(agent_config=None, temperature=0.7):
+    """
+    根据 Agent.config 中的 model / endpoint 字段生成 llm_config
+    """
+    agent_config = agent_config or {}
+    return {
+        "config_list": build_config_list(agent_config.get("model"), agent_config.get("endpoint")),
+        "temperature": temperature,
+    }
+
+
+def speaker_selection_llm_config():
+    """
+    GroupChatManager 选择发言人用的 llm_config
+    只需要返回一个名字，可通过 SPEAKER_SELECTION_MODEL / SPEAKER_SELECTION_ENDPOINT 换成更便宜更快的模型
+    """
+    return {
+        "config_list": build_config_list(
+            os.environ.get("SPEAKER_SELECTION_MODEL"),
+            os.environ.get("SPEAKER_SELECTION_ENDPOINT"),
+        ),
+        "temperature": 0,
+    }
@@ -0,0 +1,498 @@
+import inspect
+import math
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import autogen
+import openai
+from autogen import oai
+from openai import error as openai_error
+
+import profiling
+
+# 默认传输配置；TRANSPORT_LIMITS 中的字段可在 Agent.config["transport"] 中逐项覆盖
+DEFAULT_TRANSPORT_CONFIG = {
+    "max_retries": 3,              # 瞬时错误的最大重试次数
+    "backoff_base": 0.5,           # 指数退避基数 (秒)
+    "backoff_max": 8.0,            # 单次退避上限 (秒)
+    "breaker_threshold": int(os.environ.get('LLM_BREAKER_THRESHOLD', 5)),            # 连续失败多少次后熔断
+    "breaker_reset_timeout": float(os.environ.get('LLM_BREAKER_RESET_TIMEOUT', 30)), # 熔断后多久进入半开状态 (秒)
+    "hedge": False,                # 是否启用对冲请求
+    "hedge_percentile": 0.95,      # 对冲延迟取该端点延迟的哪个分位
+    "hedge_min_delay": 1.0,        # 对冲延迟下限 (秒)
+    "rate_limit_wait": 30.0,       # 所有端点都达到限速时最多排队等待多久 (秒)
+    "rate_limit_cooldown": float(os.environ.get('LLM_RATE_LIMIT_COOLDOWN', 5)),      # 收到 429 后该端点暂停多久 (秒)
+}
+
+# 客户端 (Agent.config / 访客请求) 可以调整的字段及取值范围；
+# 熔断阈值、熔断恢复时间和 429 冷却作用于进程内共享的端点状态，只能由服务端通过环境变量配置
+TRANSPORT_LIMITS = {
+    "max_retries": (0, 5),
+    "backoff_base": (0.05, 2.0),
+    "backoff_max": (0.5, 30.0),
+    "hedge": (False, True),
+    "hedge_percentile": (0.5, 0.99),
+    "hedge_min_delay": (0.5, 30.0),
+    "rate_limit_wait": (0.0, 60.0),
+}
+
+# config_list 条目中只供路由使用、不能透传给 OpenAI 接口的字段
+ROUTING_KEYS = ("rpm",)
+
+# AutoGen 自己的 llm_config 字段，不属于 OpenAI 请求参数
+AUTOGEN_KEYS = ("seed", "use_cache", "allow_format_str_template", "max_retry_period", "retry_wait_time", "api_key_path")
+
+DEFAULT_REQUEST_TIMEOUT = 60
+
+# description 参数 pyautogen 0.2 起才有，0.1.x 传入会报 TypeError (0.1.x 选择发言人时使用 system_message)
+AGENT_SUPPORTS_DESCRIPTION = "description" in inspect.signature(autogen.ConversableAgent.__init__).parameters
+
+# 可安全重试的瞬时错误 (对话补全请求没有副作用，重发是幂等的)
+RETRYABLE_ERRORS = (
+    openai_error.Timeout,
+    openai_error.TryAgain,
+    openai_error.APIError,
+    openai_error.APIConnectionError,
+    openai_error.ServiceUnavailableError,
+    openai_error.RateLimitError,
+    TimeoutError,
+    ConnectionError,
+)
+
+
+def openai_send(config_list, context=None, **params):
+    """
+    直接调用 openai.ChatCompletion 发送单个端点的请求
+    不走 oai.ChatCompletion.create：它对 APIError / ServiceUnavailableError 会无上限地原地重试，
+    重试、熔断应由传输层统一控制。同时把 config_list 中的 base_url 转成 openai<1.0 使用的 api_base
+    """
+    request = {k: v for k, v in params.items() if k not in AUTOGEN_KEYS}
+    for key, value in config_list[0].items():
+        request["api_base" if key == "base_url" else key] = value
+    request.setdefault("request_timeout", DEFAULT_REQUEST_TIMEOUT)
+    return openai.ChatCompletion.create(**request)
+
+
+def sanitize_transport_config(config):
+    """
+    过滤客户端提供的传输配置：丢弃未知字段和类型不对的值，数值截断到 TRANSPORT_LIMITS 范围内
+    :param config: dict 或 None
+    :return: dict
+    """
+    if not isinstance(config, dict):
+        return {}
+    result = {}
+    for key, (low, high) in TRANSPORT_LIMITS.items():
+        value = config.get(key)
+        if isinstance(low, bool):
+            if isinstance(value, bool):
+                result[key] = value
+            continue
+        if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value):
+            continue
+        value = min(max(value, low), high)
+        result[key] = int(value) if isinstance(low, int) else float(value)
+    return result
+
+
+class CircuitOpenError(Exception):
+    """所有可用端点都处于熔断状态"""
+
+
+class EndpointBusyError(Exception):
+    """所有可用端点都达到限速，且排队超时"""
+
+
+class CircuitBreaker:
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, clock=time.monotonic):
+        self._clock = clock
+        self._lock = threading.Lock()
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self._probe_in_flight = False
+
+    def is_open(self, reset_timeout):
+        """端点当前不接受请求：熔断中，或半开状态下探测请求还未返回"""
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                return self._probe_in_flight
+            return self.state == self.OPEN and self._clock() - self.opened_at < reset_timeout
+
+    def allow(self, reset_timeout):
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN:
+                if self._clock() - self.opened_at < reset_timeout:
+                    return False
+                self.state = self.HALF_OPEN
+                self._probe_in_flight = False
+            # 半开状态只放行一个探测请求
+            if self._probe_in_flight:
+                return False
+            self._probe_in_flight = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+            self.opened_at = None
+            self._probe_in_flight = False
+
+    def record_failure(self, threshold):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= threshold:
+                self.state = self.OPEN
+                self.opened_at = self._clock()
+            self._probe_in_flight = False
+
+    def release(self):
+        # 探测请求以非瞬时错误结束 (如参数错误)，不代表端点健康与否
+        with self._lock:
+            self._probe_in_flight = False
+
+
+class LatencyTracker:
+    def __init__(self, size=200, min_samples=20):
+        self._samples = deque(maxlen=size)
+        self._min_samples = min_samples
+        self._lock = threading.Lock()
+
+    def record(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, p):
+        """样本不足时返回 None"""
+        with self._lock:
+            if len(self._samples) < self._min_samples:
+                return None
+            ordered = sorted(self._samples)
+        index = min(len(ordered) - 1, int(p * len(ordered)))
+        return ordered[index]
+
+
+class RateLimiter:
+    """滑动窗口限速：每个端点 (API key) 每分钟最多 rpm 个请求，rpm 为空表示不限"""
+
+    def __init__(self, rpm=None, window=60.0, clock=time.monotonic):
+        self.rpm = rpm
+        self._window = window
+        self._clock = clock
+        self._sent = deque()
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def _wait_time(self, now):
+        wait_for = max(0.0, self._blocked_until - now)
+        if self.rpm:
+            while self._sent and now - self._sent[0] >= self._window:
+                self._sent.popleft()
+            if len(self._sent) >= self.rpm:
+                wait_for = max(wait_for, self._sent[0] + self._window - now)
+        return wait_for
+
+    def wait_time(self):
+        with self._lock:
+            return self._wait_time(self._clock())
+
+    def try_acquire(self):
+        with self._lock:
+            now = self._clock()
+            if self._wait_time(now) > 0:
+                return False
+            if self.rpm:
+                self._sent.append(now)
+            return True
+
+    def penalize(self, seconds):
+        # 服务端返回 429 时，说明本地估计偏乐观，暂停该端点一段时间
+        with self._lock:
+            self._blocked_until = max(self._blocked_until, self._clock() + seconds)
+
+
+class KeyState:
+    """同一 API key 的限速和在途请求数，该 key 下所有模型共用 (服务商按 key 计配额)"""
+
+    def __init__(self, rpm=None):
+        self.rate = RateLimiter(rpm)
+        self.outstanding = 0
+        self._lock = threading.Lock()
+
+    def begin(self):
+        with self._lock:
+            self.outstanding += 1
+
+    def end(self):
+        with self._lock:
+            self.outstanding -= 1
+
+
+class EndpointState:
+    """
+    (端点, 模型, key) 维度的状态：熔断和延迟按模型区分，限速和在途请求数取自所属 key
+    :param key_state: KeyState
+    """
+
+    def __init__(self, key_state):
+        self.breaker = CircuitBreaker()
+        self.latency = LatencyTracker()
+        self.key_state = key_state
+
+    @property
+    def rate(self):
+        return self.key_state.rate
+
+    @property
+    def outstanding(self):
+        return self.key_state.outstanding
+
+    def begin(self):
+        self.key_state.begin()
+
+    def end(self):
+        self.key_state.end()
+
+
+# 端点状态在进程内共享：每次对话都会新建 Agent，但熔断、延迟统计和限速需要跨对话累积
+_endpoint_states = {}
+_key_states = {}
+_endpoint_states_lock = threading.Lock()
+
+# 对冲请求使用的线程池；落败的请求无法取消，会在后台自然结束。
+# 名额与线程数相同且不阻塞获取，任务永远不会在池中排队 (排队等待会被误判为端点变慢)
+HEDGE_WORKERS = int(os.environ.get('LLM_HEDGE_WORKERS', 32))
+_hedge_executor = ThreadPoolExecutor(max_workers=HEDGE_WORKERS, thread_name_prefix="llm-hedge")
+_hedge_slots = threading.BoundedSemaphore(HEDGE_WORKERS)
+
+
+def _submit_on_slot(func, *args):
+    """在已占用的名额上提交任务，任务结束时归还名额"""
+    try:
+        future = _hedge_executor.submit(func, *args)
+    except BaseException:
+        _hedge_slots.release()
+        raise
+    future.add_done_callback(lambda _: _hedge_slots.release())
+    return future
+
+
+def endpoint_key(endpoint):
+    return (endpoint.get("base_url"), endpoint.get("model"), endpoint.get("api_key"))
+
+
+def api_key_key(endpoint):
+    return (endpoint.get("base_url"), endpoint.get("api_key"))
+
+
+def get_endpoint_state(endpoint):
+    with _endpoint_states_lock:
+        key_state = _key_states.get(api_key_key(endpoint))
+        if key_state is None:
+            key_state = _key_states[api_key_key(endpoint)] = KeyState(endpoint.get("rpm"))
+        else:
+            key_state.rate.rpm = endpoint.get("rpm")
+        state = _endpoint_states.get(endpoint_key(endpoint))
+        if state is None:
+            state = _endpoint_states[endpoint_key(endpoint)] = EndpointState(key_state)
+        return state
+
+
+class ResilientTransport:
+    """
+    LLM 请求传输层：抖动指数退避重试 + 端点熔断 + 可选对冲请求，
+    并在 config_list 的多个端点 / API key 之间按最少在途请求负载均衡、按 rpm 限速
+    :param config: dict, 覆盖 DEFAULT_TRANSPORT_CONFIG 的配置 (来自客户端，经 sanitize_transport_config 过滤)
+    :param send: callable, 实际发送请求的函数，默认 openai_send；
+                 可替换为本地故障注入桩 (见 fault_stub.py) 进行测试
+    """
+
+    def __init__(self, config=None, send=None, sleep=time.sleep):
+        self.config = dict(DEFAULT_TRANSPORT_CONFIG)
+        self.config.update(sanitize_transport_config(config))
+        self._send = send or openai_send
+        self._sleep = sleep
+
+    def create(self, config_list, **params):
+        if not config_list:
+            raise ValueError("config_list must contain at least one endpoint")
+
+        max_retries = int(self.config["max_retries"])
+        last_error = None
+        failed_endpoint = None
+        for attempt in range(max_retries + 1):
+            try:
+                # 重试时优先换一个端点
+                endpoint = self._acquire_endpoint(config_list, exclude=failed_endpoint)
+            except CircuitOpenError:
+                if last_error is not None:
+                    raise last_error
+                raise
+            try:
+                return self._call(endpoint, config_list, params)
+            except RETRYABLE_ERRORS as e:
+                last_error = e
+                failed_endpoint = endpoint
+                if attempt == max_retries:
+                    raise
+                with profiling.span("retry_backoff", attempt=attempt + 1):
+                    self._sleep(self._backoff(attempt))
+        raise last_error
+
+    def _backoff(self, attempt):
+        # Full jitter: 在 [0, min(上限, 基数 * 2^n)] 之间随机等待
+        cap = min(float(self.config["backoff_max"]), float(self.config["backoff_base"]) * (2 ** attempt))
+        return random.uniform(0, cap)
+
+    def _acquire_endpoint(self, config_list, exclude=None):
+        reset_timeout = float(self.config["breaker_reset_timeout"])
+        deadline = time.monotonic() + float(self.config["rate_limit_wait"])
+        while True:
+            endpoint = self._pick_endpoint(config_list, exclude=exclude) or self._pick_endpoint(config_list)
+            if endpoint is not None:
+                return endpoint
+
+            states = [get_endpoint_state(e) for e in config_list]
+            # 熔断中 / 半开探测中的端点不等待，只有真正的限速窗口才值得排队
+            waits = [s.rate.wait_time() for s in states if not s.breaker.is_open(reset_timeout)]
+            if not waits:
+                raise CircuitOpenError("All LLM endpoints are unavailable (circuit open)")
+            # 等待最早空出的限速名额；名额刚被其他线程抢走时 wait 为 0，稍等再试
+            delay = max(min(waits), 0.1)
+            if time.monotonic() + delay > deadline:
+                raise EndpointBusyError("All LLM endpoints are rate limited")
+            self._sleep(delay)
+
+    def _pick_endpoint(self, config_list, exclude=None):
+        reset_timeout = float(self.config["breaker_reset_timeout"])
+        candidates = [e for e in config_list if e is not exclude]
+        # 最少在途请求优先；先打乱顺序，让空闲时的请求均匀分散到各个 key
+        random.shuffle(candidates)
+        candidates.sort(key=lambda e: get_endpoint_state(e).outstanding)
+        for endpoint in candidates:
+            state = get_endpoint_state(endpoint)
+            if state.rate.wait_time() > 0:
+                continue
+            if not state.breaker.allow(reset_timeout):
+                continue
+            if not state.rate.try_acquire():
+                state.breaker.release()
+                continue
+            return endpoint
+        return None
+
+    def _call(self, endpoint, config_list, params):
+        if not self.config["hedge"]:
+            return self._send_once(endpoint, params)
+
+        delay = get_endpoint_state(endpoint).latency.percentile(float(self.config["hedge_percentile"]))
+        if delay is None:
+            # 样本不足，还无法估计尾延迟
+            return self._send_once(endpoint, params)
+        delay = max(delay, float(self.config["hedge_min_delay"]))
+
+        if not _hedge_slots.acquire(blocking=False):
+            # 线程池已满：不对冲，直接在当前 (对话) 线程发送
+            return self._send_once(endpoint, params)
+        primary = _submit_on_slot(self._send_once, endpoint, params)
+        done, _ = wait([primary], timeout=delay)
+        if done:
+            return primary.result()
+
+        # 先占线程名额再选端点，没有空闲线程时不会白白占用限速名额
+        if not _hedge_slots.acquire(blocking=False):
+            return primary.result()
+        # 优先对冲到另一个端点，没有的话再打同一个端点
+        hedge_endpoint = self._pick_endpoint(config_list, exclude=endpoint) or self._pick_endpoint(config_list)
+        if hedge_endpoint is None:
+            _hedge_slots.release()
+            return primary.result()
+        secondary = _submit_on_slot(self._send_once, hedge_endpoint, params)
+
+        pending = {primary, secondary}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    return future.result()
+                error = future.exception()
+        raise error
+
+    def _send_once(self, endpoint, params):
+        state = get_endpoint_state(endpoint)
+        request_endpoint = {k: v for k, v in endpoint.items() if k not in ROUTING_KEYS}
+        state.begin()
+        start = time.monotonic()
+        try:
+            response = self._send(config_list=[request_endpoint], **params)
+        except openai_error.RateLimitError:
+            # 429 说明端点健康但配额不足，只做冷却，不计入熔断
+            state.rate.penalize(float(self.config["rate_limit_cooldown"]))
+            state.breaker.release()
+            raise
+        except RETRYABLE_ERRORS:
+            state.breaker.record_failure(int(self.config["breaker_threshold"]))
+            raise
+        except Exception:
+            state.breaker.release()
+            raise
+        finally:
+            state.end()
+        state.latency.record(time.monotonic() - start)
+        state.breaker.record_success()
+        return response
+
+
+class ResilientReplyMixin:
+    """将 AutoGen 的 generate_oai_reply 换成走 ResilientTransport 的版本"""
+
+    def __init__(self, *args, transport=None, **kwargs):
+        if not AGENT_SUPPORTS_DESCRIPTION:
+            kwargs.pop("description", None)
+        super().__init__(*args, **kwargs)
+        self._transport = transport or ResilientTransport()
+        # AutoGen 在回复链中注册的是未绑定的 ConversableAgent.generate_oai_reply，
+        # 子类覆盖方法不会生效，需要替换回复链里的条目
+        for entry in self._reply_func_list:
+            if entry["reply_func"] is autogen.ConversableAgent.generate_oai_reply:
+                entry["reply_func"] = type(self).generate_oai_reply
+
+    def generate_oai_reply(self, messages=None, sender=None, config=None):
+        llm_config = self.llm_config if config is None else config
+        if llm_config is False:
+            return False, None
+        if messages is None:
+            messages = self._oai_messages[sender]
+
+        params = dict(llm_config)
+        config_list = params.pop("config_list")
+        with profiling.span("llm", agent=self.name, messages=len(messages)):
+            response = self._transport.create(
+                config_list,
+                context=messages[-1].pop("context", None),
+                messages=self._oai_system_message + list(messages),
+                **params
+            )
+        return True, oai.ChatCompletion.extract_text_or_function_call(response)[0]
+
+
+class ResilientAssistantAgent(ResilientReplyMixin, autogen.AssistantAgent):
+    pass
+
+
+class ResilientGroupChatManager(ResilientReplyMixin, autogen.GroupChatManager):
+    # GroupChat.select_speaker 直接调用 manager.generate_oai_reply 选择发言人，
+    # 因此发言人选择也会经过传输层
+    pass
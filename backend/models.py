@@ -1,5 +1,6 @@
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import JSON
+from sqlalchemy import JSON, func
+from sqlalchemy.orm import aliased
 from datetime import datetime
 from werkzeug.security import generate_password_hash, check_password_hash
 
@@ -55,7 +56,7 @@ class Conversation(db.Model):
 
 class Message(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    conversation_id = db.Column(db.Integer, db.ForeignKey('conversation.id'), nullable=False)
+    conversation_id = db.Column(db.Integer, db.ForeignKey('conversation.id'), nullable=False, index=True)
     role = db.Column(db.String(20), nullable=False, default='assistant') # user, assistant, system
     name = db.Column(db.String(100), nullable=True) # 具体是谁说的
     content = db.Column(db.Text, nullable=False)
@@ -70,3 +71,81 @@ class Message(db.Model):
             "content": self.content,
             "timestamp": self.timestamp.isoformat()
         }
+
+class ArchiveDictionary(db.Model):
+    # 压缩归档消息用的共享字典 (由智能体人设文本训练)，段落记录所用字典 id，字典更新后旧段落仍可解压
+    id = db.Column(db.Integer, primary_key=True)
+    data = db.Column(db.LargeBinary, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class ConversationSegment(db.Model):
+    # 冷存储：一个会话的全部历史消息压缩成一个段落；存在该记录即表示会话已归档
+    id = db.Column(db.Integer, primary_key=True)
+    conversation_id = db.Column(db.Integer, db.ForeignKey('conversation.id'), nullable=False, unique=True)
+    dictionary_id = db.Column(db.Integer, db.ForeignKey('archive_dictionary.id'), nullable=True)
+    codec = db.Column(db.String(20), nullable=False, default='zlib')
+    data = db.Column(db.LargeBinary, nullable=False)
+    message_count = db.Column(db.Integer, nullable=False, default=0)
+    last_message_name = db.Column(db.String(100), nullable=True)
+    last_message_preview = db.Column(db.String(200), nullable=True)
+    archived_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+# --- 列投影查询 (列表接口只取需要的列，不构造 ORM 对象) ---
+
+AGENT_FIELDS = ("id", "user_id", "name", "system_message", "config", "created_at")
+MESSAGE_FIELDS = ("id", "conversation_id", "role", "name", "content", "timestamp")
+PREVIEW_LENGTH = 80
+
+def _as_dicts(query):
+    # Row._asdict() 每行都要重建映射，字段名只取一次要快得多
+    rows = query.all()
+    if not rows:
+        return []
+    keys = rows[0]._fields
+    return [dict(zip(keys, row)) for row in rows]
+
+def agent_rows(user_id, fields=AGENT_FIELDS):
+    columns = [getattr(Agent, f) for f in fields]
+    return _as_dicts(db.session.query(*columns).filter(Agent.user_id == user_id))
+
+def message_rows(conversation_id, fields=MESSAGE_FIELDS):
+    columns = [getattr(Message, f) for f in fields]
+    query = db.session.query(*columns).filter(Message.conversation_id == conversation_id)
+    return _as_dicts(query.order_by(Message.timestamp.asc()))
+
+def conversation_summaries(user_id):
+    """
+    会话列表：一次聚合查询带出消息数和最后一条消息的预览，避免逐个会话查询
+    """
+    stats = (
+        db.session.query(
+            Message.conversation_id.label("conversation_id"),
+            func.count(Message.id).label("message_count"),
+            func.max(Message.id).label("last_message_id"),
+        )
+        .join(Conversation, Conversation.id == Message.conversation_id)
+        .filter(Conversation.user_id == user_id)
+        .group_by(Message.conversation_id)
+        .subquery()
+    )
+    last = aliased(Message)
+    query = (
+        db.session.query(
+            Conversation.id,
+            Conversation.user_id,
+            Conversation.title,
+            Conversation.agent_ids,
+            Conversation.created_at,
+            Conversation.updated_at,
+            (func.coalesce(stats.c.message_count, 0) + func.coalesce(ConversationSegment.message_count, 0)).label("message_count"),
+            func.coalesce(last.name, ConversationSegment.last_message_name).label("last_message_name"),
+            func.coalesce(func.substr(last.content, 1, PREVIEW_LENGTH), ConversationSegment.last_message_preview).label("last_message_preview"),
+        )
+        .outerjoin(stats, stats.c.conversation_id == Conversation.id)
+        .outerjoin(last, last.id == stats.c.last_message_id)
+        # 已归档会话的消息数和预览保存在段落记录上
+        .outerjoin(ConversationSegment, ConversationSegment.conversation_id == Conversation.id)
+        .filter(Conversation.user_id == user_id)
+        .order_by(Conversation.updated_at.desc())
+    )
+    return _as_dicts(query)
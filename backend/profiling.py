@@ -0,0 +1,467 @@
+"""
+按请求开启的性能剖析：墙钟采样 (请求线程 + 对话后台线程) + 分段计时 (span)
+
+开启方式：
+- 请求头 X-Profile-Token: <PROFILE_ADMIN_TOKEN>，对该请求开启
+- PROFILE_SAMPLE_RATE (0~1)，按比例随机抽样 PROFILE_SAMPLE_ENDPOINTS 中的接口 (默认只有 chat_stream)
+
+被剖析的请求在响应头 X-Profile-Id 中返回剖析 id，结果保存在 PROFILE_DIR，
+通过 /api/profiles/<id>/collapsed (火焰图折叠栈) 或 /api/profiles/<id>/speedscope 下载。
+下载同样需要 X-Profile-Token 请求头 (不接受查询参数，避免 token 出现在访问日志和 Referer 中)。
+"""
+import hmac
+import json
+import logging
+import os
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+
+from flask import Response, abort, g, jsonify, request
+
+logger = logging.getLogger(__name__)
+
+PROFILE_ADMIN_TOKEN = os.environ.get('PROFILE_ADMIN_TOKEN')
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))
+PROFILE_SAMPLE_ENDPOINTS = tuple(
+    e.strip() for e in os.environ.get('PROFILE_SAMPLE_ENDPOINTS', 'chat_stream').split(',') if e.strip()
+)
+PROFILE_INTERVAL = float(os.environ.get('PROFILE_INTERVAL', 0.01))  # 采样间隔 (秒)
+PROFILE_MAX_ACTIVE = int(os.environ.get('PROFILE_MAX_ACTIVE', 2))    # 同时进行的剖析上限
+PROFILE_KEEP = int(os.environ.get('PROFILE_KEEP', 50))               # 保留最近多少份结果
+PROFILE_DIR = os.environ.get('PROFILE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'profiles'))
+MAX_STACK_DEPTH = 128
+
+_PROFILE_ID = re.compile(r'^[0-9a-f]{32}$')
+
+
+class Profile:
+    """
+    一次剖析：后台线程定时读取已登记线程的调用栈，同时记录 span 时间线
+    :param meta: dict, 请求信息 (method / path / endpoint)
+    :param interval: float, 采样间隔 (秒)
+    """
+
+    def __init__(self, meta, interval=PROFILE_INTERVAL):
+        self.id = uuid.uuid4().hex
+        self.meta = meta
+        self.interval = interval
+        self.started_at = datetime.utcnow()
+        self._t0 = time.perf_counter()
+        self._threads = {}   # ident -> 线程标签
+        self._samples = {}   # 线程标签 -> [(毫秒, 栈 id)]
+        self._frames = []    # [(函数名, 文件, 行号)]
+        self._frame_index = {}
+        self._stacks = []    # [(帧 id, ...)]，根帧在前
+        self._stack_index = {}
+        self.spans = []      # [{"name", "thread", "start", "end", "attrs"}]
+        self._span_events = []  # [("O"/"C", span id)]，按发生顺序
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._sampler = threading.Thread(target=self._run, name="profile-sampler", daemon=True)
+        self.finished = False
+
+    def now(self):
+        return (time.perf_counter() - self._t0) * 1000
+
+    def start(self):
+        self._sampler.start()
+
+    # --- 线程登记 ---
+
+    def add_thread(self, label, ident=None):
+        with self._lock:
+            self._threads[ident or threading.get_ident()] = label
+
+    def remove_thread(self, ident=None):
+        ident = ident or threading.get_ident()
+        with self._lock:
+            label = self._threads.pop(ident, None)
+        if label is not None:
+            self._close_spans(label)
+
+    def _thread_label(self):
+        ident = threading.get_ident()
+        with self._lock:
+            return self._threads.get(ident) or threading.current_thread().name
+
+    # --- 采样 ---
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def _sample(self):
+        frames = sys._current_frames()
+        t = self.now()
+        with self._lock:
+            threads = list(self._threads.items())
+        for ident, label in threads:
+            frame = frames.get(ident)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None and len(stack) < MAX_STACK_DEPTH:
+                stack.append(self._frame_id(frame.f_code))
+                frame = frame.f_back
+            stack.reverse()
+            self._samples.setdefault(label, []).append((t, self._stack_id(tuple(stack))))
+
+    def _frame_id(self, code):
+        # 只有采样线程写入帧表和栈表，不需要加锁
+        index = self._frame_index.get(code)
+        if index is None:
+            index = len(self._frames)
+            self._frames.append((code.co_name, code.co_filename, code.co_firstlineno))
+            self._frame_index[code] = index
+        return index
+
+    def _stack_id(self, stack):
+        index = self._stack_index.get(stack)
+        if index is None:
+            index = len(self._stacks)
+            self._stacks.append(stack)
+            self._stack_index[stack] = index
+        return index
+
+    # --- span ---
+
+    def begin(self, name, **attrs):
+        span = {"name": name, "thread": self._thread_label(), "start": self.now(), "end": None, "attrs": attrs}
+        with self._lock:
+            span_id = len(self.spans)
+            self.spans.append(span)
+            self._span_events.append(("O", span_id))
+        return span_id
+
+    def end(self, span_id):
+        with self._lock:
+            span = self.spans[span_id]
+            if span["end"] is None:
+                span["end"] = self.now()
+                self._span_events.append(("C", span_id))
+
+    def _close_spans(self, thread=None):
+        # 线程退出或剖析结束时，未关闭的 span 按打开的逆序关闭
+        with self._lock:
+            open_ids = [i for i, s in enumerate(self.spans)
+                        if s["end"] is None and (thread is None or s["thread"] == thread)]
+        for span_id in reversed(open_ids):
+            self.end(span_id)
+
+    # --- 结束 / 保存 ---
+
+    def finish(self):
+        if self.finished:
+            return
+        self.finished = True
+        self._stop.set()
+        if self._sampler.is_alive() and self._sampler is not threading.current_thread():
+            self._sampler.join()
+        self._close_spans()
+        _release_slot()
+        try:
+            save(self.to_dict())
+        except Exception:
+            logger.exception(f"Failed to save profile {self.id}")
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            **self.meta,
+            "started_at": self.started_at.isoformat(),
+            "duration_ms": self.now(),
+            "interval_ms": self.interval * 1000,
+            "frames": self._frames,
+            "stacks": self._stacks,
+            "samples": self._samples,
+            "spans": self.spans,
+            "span_events": self._span_events,
+        }
+
+
+# --- 当前线程的剖析 ---
+
+_local = threading.local()
+
+
+def current():
+    """当前线程正在进行的剖析，没有则返回 None"""
+    return getattr(_local, "profile", None)
+
+
+@contextmanager
+def attach(profile, label):
+    """
+    把当前线程登记到剖析中 (用于请求之外新开的线程，例如 run_chat_thread)
+    :param profile: Profile 或 None (None 时什么也不做)
+    :param label: str, 线程在结果中的名字
+    """
+    if profile is None:
+        yield
+        return
+    previous = current()
+    _local.profile = profile
+    profile.add_thread(label)
+    try:
+        yield
+    finally:
+        profile.remove_thread()
+        _local.profile = previous
+
+
+@contextmanager
+def span(name, **attrs):
+    """记录一段耗时；当前线程没有剖析时开销只有一次属性查找"""
+    profile = current()
+    if profile is None:
+        yield
+        return
+    span_id = profile.begin(name, **attrs)
+    try:
+        yield
+    finally:
+        profile.end(span_id)
+
+
+# --- 并发上限 ---
+
+_active = 0
+_active_lock = threading.Lock()
+
+
+def _acquire_slot():
+    global _active
+    with _active_lock:
+        if _active >= PROFILE_MAX_ACTIVE:
+            return False
+        _active += 1
+        return True
+
+
+def _release_slot():
+    global _active
+    with _active_lock:
+        _active = max(0, _active - 1)
+
+
+# --- 存储与导出 ---
+
+def _path(profile_id):
+    return os.path.join(PROFILE_DIR, f"{profile_id}.json")
+
+
+def save(data):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    tmp_path = _path(data["id"]) + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, separators=(",", ":"))
+    os.replace(tmp_path, _path(data["id"]))
+
+    # 只保留最近 PROFILE_KEEP 份
+    files = sorted(
+        (os.path.join(PROFILE_DIR, name) for name in os.listdir(PROFILE_DIR) if name.endswith(".json")),
+        key=os.path.getmtime,
+    )
+    for old in files[:-PROFILE_KEEP] if PROFILE_KEEP > 0 else []:
+        os.remove(old)
+
+
+def load(profile_id):
+    if not _PROFILE_ID.match(profile_id or ""):
+        return None
+    try:
+        with open(_path(profile_id), encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def list_profiles():
+    if not os.path.isdir(PROFILE_DIR):
+        return []
+    result = []
+    for name in os.listdir(PROFILE_DIR):
+        if not name.endswith(".json"):
+            continue
+        data = load(name[:-5])
+        if data is None:
+            continue
+        result.append({k: data.get(k) for k in ("id", "method", "path", "endpoint", "started_at", "duration_ms")})
+    result.sort(key=lambda p: p["started_at"] or "", reverse=True)
+    return result
+
+
+def _frame_name(frame):
+    name, filename, line = frame
+    return f"{name} ({os.path.basename(filename)}:{line})"
+
+
+def to_collapsed(data):
+    """
+    折叠栈格式 (flamegraph.pl / speedscope 均可导入)：线程;根帧;...;叶帧 样本数
+    """
+    names = [_frame_name(f) for f in data["frames"]]
+    counts = {}
+    for thread, samples in data["samples"].items():
+        for _, stack_id in samples:
+            key = (thread, stack_id)
+            counts[key] = counts.get(key, 0) + 1
+    lines = []
+    for (thread, stack_id), count in sorted(counts.items()):
+        frames = [thread] + [names[i] for i in data["stacks"][stack_id]]
+        lines.append(f"{';'.join(frames)} {count}")
+    return "\n".join(lines) + "\n"
+
+
+def to_speedscope(data):
+    """
+    speedscope 文件格式：每个线程一个采样 profile，每个线程的 span 时间线一个事件 profile
+    """
+    frames = [{"name": f[0], "file": f[1], "line": f[2]} for f in data["frames"]]
+    interval = data["interval_ms"]
+    end_value = data["duration_ms"]
+    profiles = []
+
+    for thread, samples in data["samples"].items():
+        profiles.append({
+            "type": "sampled",
+            "name": thread,
+            "unit": "milliseconds",
+            "startValue": samples[0][0] - interval if samples else 0,
+            "endValue": samples[-1][0] if samples else 0,
+            "samples": [data["stacks"][stack_id] for _, stack_id in samples],
+            "weights": [interval] * len(samples),
+        })
+
+    # span 作为额外的帧追加在帧表之后
+    span_frames = {}
+    events_by_thread = {}
+    for kind, span_id in data["span_events"]:
+        span = data["spans"][span_id]
+        label = span["name"]
+        if span["attrs"]:
+            label += " " + " ".join(f"{k}={v}" for k, v in span["attrs"].items())
+        if label not in span_frames:
+            span_frames[label] = len(frames)
+            frames.append({"name": label})
+        events_by_thread.setdefault(span["thread"], []).append({
+            "type": kind,
+            "frame": span_frames[label],
+            "at": span["start"] if kind == "O" else span["end"],
+        })
+    for thread, events in events_by_thread.items():
+        profiles.append({
+            "type": "evented",
+            "name": f"{thread} spans",
+            "unit": "milliseconds",
+            "startValue": 0,
+            "endValue": max(end_value, events[-1]["at"]),
+            "events": events,
+        })
+
+    return {
+        "$schema": "https://www.speedscope.app/file-format-schema.json",
+        "shared": {"frames": frames},
+        "profiles": profiles,
+        "name": f"{data.get('method')} {data.get('path')} {data['started_at']}",
+        "exporter": "autogen-app profiling",
+    }
+
+
+# --- Flask 接入 ---
+
+def _is_admin():
+    if not PROFILE_ADMIN_TOKEN:
+        return False
+    token = request.headers.get('X-Profile-Token') or ""
+    return hmac.compare_digest(token.encode(), PROFILE_ADMIN_TOKEN.encode())
+
+
+def _should_profile():
+    if not request.path.startswith('/api/') or request.path.startswith('/api/profiles'):
+        return False
+    if request.headers.get('X-Profile-Token'):
+        return _is_admin()
+    return PROFILE_SAMPLE_RATE > 0 and request.endpoint in PROFILE_SAMPLE_ENDPOINTS \
+        and random.random() < PROFILE_SAMPLE_RATE
+
+
+def _close(profile, ident):
+    # 流式响应的生成器在关闭响应时才结束，剖析要持续到那时
+    profile.remove_thread(ident)
+    if current() is profile:
+        _local.profile = None
+    profile.finish()
+
+
+def init_profiling(app):
+    """注册请求钩子和剖析结果下载接口"""
+
+    @app.before_request
+    def start_profile():
+        _local.profile = None
+        if not _should_profile() or not _acquire_slot():
+            return
+        profile = Profile({"method": request.method, "path": request.path, "endpoint": request.endpoint})
+        profile.add_thread("request")
+        profile.start()
+        _local.profile = profile
+        g.profile = profile
+
+    @app.after_request
+    def attach_profile(response):
+        profile = g.pop('profile', None)
+        if profile is not None:
+            response.headers['X-Profile-Id'] = profile.id
+            response.call_on_close(lambda ident=threading.get_ident(): _close(profile, ident))
+        return response
+
+    @app.teardown_request
+    def abandon_profile(exc):
+        # after_request 没有执行 (未处理的异常) 时在这里收尾
+        profile = g.pop('profile', None)
+        if profile is not None:
+            _close(profile, threading.get_ident())
+
+    def require_admin():
+        if not _is_admin():
+            abort(404)
+
+    @app.route('/api/profiles', methods=['GET'])
+    def get_profiles():
+        require_admin()
+        return jsonify(list_profiles())
+
+    @app.route('/api/profiles/<profile_id>', methods=['GET'])
+    def get_profile(profile_id):
+        require_admin()
+        data = load(profile_id)
+        if data is None:
+            abort(404)
+        # 时间线和元数据，不含原始采样
+        return jsonify({k: v for k, v in data.items() if k not in ("frames", "stacks", "samples", "span_events")})
+
+    @app.route('/api/profiles/<profile_id>/collapsed', methods=['GET'])
+    def get_profile_collapsed(profile_id):
+        require_admin()
+        data = load(profile_id)
+        if data is None:
+            abort(404)
+        return Response(to_collapsed(data), mimetype='text/plain',
+                        headers={'Content-Disposition': f'attachment; filename="{profile_id}.collapsed.txt"'})
+
+    @app.route('/api/profiles/<profile_id>/speedscope', methods=['GET'])
+    def get_profile_speedscope(profile_id):
+        require_admin()
+        data = load(profile_id)
+        if data is None:
+            abort(404)
+        response = jsonify(to_speedscope(data))
+        response.headers['Content-Disposition'] = f'attachment; filename="{profile_id}.speedscope.json"'
+        return response